@@ -0,0 +1,130 @@
+from src.html_parser import HTMLParser
+from src.css_parser import CSSParser, RuleIndex, style, tree_to_list, iter_tree
+from src.layout import DocumentLayout, paint_tree
+from src.fonts import set_font_backend, HeadlessFonts
+from src.tag_selector import AncestorFilter, cascade_priority
+from src.page import default_style_sheet
+import sys
+import time
+import tracemalloc
+
+def nested_markup(depth):
+    return "<div>" * depth + "text" + "</div>" * depth
+
+def list_markup(items):
+    return "<ul>" + "".join(f"<li class=item><a href=#{i}>Item</a> number <b>{i}</b></li>" for i in range(items)) + "</ul>"
+
+def bench_nesting():
+    # Parse time per tag should stay flat as the nesting gets deeper
+    print("HTMLParser on nested <div> markup")
+    print(f"{'depth':>8} {'seconds':>10} {'us/tag':>8}")
+    for depth in [2000, 4000, 8000, 16000, 32000]:
+        body = nested_markup(depth)
+        start = time.perf_counter()
+        HTMLParser(body).parse()
+        elapsed = time.perf_counter() - start
+        print(f"{depth:>8} {elapsed:>10.4f} {elapsed / (2 * depth) * 1e6:>8.2f}")
+
+def bench_memory():
+    # Memory held by the DOM per node, before and after styling
+    print("DOM memory per node")
+    body = list_markup(25000)
+    rules = sorted(default_style_sheet(), key=cascade_priority)
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    nodes = HTMLParser(body).parse()
+    parsed = tracemalloc.get_traced_memory()[0]
+    style(nodes, rules)
+    styled = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    count = len(tree_to_list(nodes, []))
+    print(f"{count} nodes")
+    print(f"{'parsed':>8} {(parsed - before) / count:>8.1f} bytes/node")
+    print(f"{'styled':>8} {(styled - before) / count:>8.1f} bytes/node")
+
+def generated_stylesheet(count):
+    tags = ["div", "p", "ul", "li", "a", "b", "i", "span", "table", "td", "h1", "h2", "nav", "section"]
+    rules = []
+    for i in range(count):
+        ancestor = tags[i % len(tags)]
+        tag = tags[(i * 7) % len(tags)]
+        rules.append(f"{ancestor} {tag} {{ color: c{i}; }}" if i % 2 else f"{tag} {{ color: c{i}; }}")
+    return "\n".join(rules)
+
+def bench_style():
+    # Restyle time of a large list against a growing stylesheet
+    print("style() on a 150k node list")
+    nodes = HTMLParser(list_markup(25000)).parse()
+    print(f"{'rules':>8} {'seconds':>10}")
+    for count in [100, 500, 2000]:
+        rules = CSSParser(generated_stylesheet(count)).parse()
+        rules = RuleIndex(sorted(rules, key=cascade_priority))
+        start = time.perf_counter()
+        style(nodes, rules)
+        print(f"{count:>8} {time.perf_counter() - start:>10.3f}")
+
+class NoAncestorFilter(AncestorFilter):
+    def might_contain(self, hashes):
+        return True
+
+def bench_descendant():
+    # Descendant selectors on a deep document, with and without the ancestor filter
+    print("Descendant selectors on nested <div> markup, 200 rules")
+    css = "\n".join(f"{tag}{i} div {{ color: c{i}; }}" for i, tag in enumerate(["nav", "table", "ul", "article"] * 50))
+    rules = RuleIndex(sorted(CSSParser(css).parse(), key=cascade_priority))
+    print(f"{'depth':>8} {'no filter':>10} {'filter':>10}")
+    for depth in [100, 200, 400]:
+        nodes = HTMLParser(nested_markup(depth)).parse()
+        times = []
+        for ancestors in [NoAncestorFilter(), AncestorFilter()]:
+            start = time.perf_counter()
+            style(nodes, rules, ancestors)
+            times.append(time.perf_counter() - start)
+        print(f"{depth:>8} {times[0]:>10.3f} {times[1]:>10.3f}")
+
+def bench_deep():
+    # The whole pipeline on a 50k deep document, which used to overflow the recursion limit
+    depth = 50000
+    print(f"Pipeline on {depth} nested <div>s")
+    body = nested_markup(depth)
+    rules = RuleIndex(sorted(default_style_sheet(), key=cascade_priority))
+
+    start = time.perf_counter()
+    nodes = HTMLParser(body).parse()
+    print(f"{'parse':>8} {time.perf_counter() - start:>8.3f}s")
+
+    start = time.perf_counter()
+    style(nodes, rules)
+    print(f"{'style':>8} {time.perf_counter() - start:>8.3f}s")
+
+    start = time.perf_counter()
+    count = sum(1 for _ in iter_tree(nodes))
+    print(f"{'walk':>8} {time.perf_counter() - start:>8.3f}s ({count} nodes)")
+
+    start = time.perf_counter()
+    document = DocumentLayout(nodes, 800)
+    document.layout()
+    print(f"{'layout':>8} {time.perf_counter() - start:>8.3f}s")
+
+    start = time.perf_counter()
+    display_list = []
+    paint_tree(document, display_list)
+    print(f"{'paint':>8} {time.perf_counter() - start:>8.3f}s ({len(display_list)} commands)")
+
+BENCHMARKS = {
+    "nesting": bench_nesting,
+    "memory": bench_memory,
+    "style": bench_style,
+    "descendant": bench_descendant,
+    "deep": bench_deep,
+}
+
+if __name__ == "__main__":
+    # Layout runs on fixed font metrics, no display is needed
+    set_font_backend(HeadlessFonts(fixed=True))
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
+        print()
@@ -1,14 +1,27 @@
+from src import startup
 from src.browser import Browser
 from src.url import URL
-from tkinter import *
+import os
+import sys
 
 if __name__ == "__main__":
-    import sys
+    # --startup-report prints how long each step up to the first paint took
+    if "--startup-report" in sys.argv:
+        sys.argv.remove("--startup-report")
+        startup.enable()
+    startup.mark("imports")
+
     if len(sys.argv) > 1 and sys.argv[1]: 
         url = sys.argv[1]
     else:
-        url = "file:///home/kevinpe/Documents/web-browser/homepage.html"
+        url = "file://" + os.path.join(os.path.dirname(os.path.abspath(__file__)), "homepage.html")
         
     browser = Browser()
-    browser.load(URL(url))    
-    browser.window.mainloop()
\ No newline at end of file
+    startup.mark("window")
+    browser.load(URL(url))
+    if startup.REPORT:
+        # Let Tk draw the window so the report includes the first paint
+        browser.window.update()
+        startup.mark("first paint")
+    startup.finish()
+    browser.window.mainloop()
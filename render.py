@@ -0,0 +1,173 @@
+from src.url import URL
+from src.page import load_dom, load_stylesheets, default_style_sheet
+from src.css_parser import RuleIndex, style
+from src.tag_selector import cascade_priority
+from src.layout import DocumentLayout, paint_tree, VSTEP
+from src.draw import DrawText, DrawRect, DrawImage
+from src.emoji_atlas import get_emoji_atlas
+from src.fonts import set_font_backend, HeadlessFonts
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import multiprocessing.util
+import json
+import os
+import re
+import sys
+
+# Renders pages without Tk: fetch, parse, style, layout and paint each page and
+# write out its display list as JSON or as a PNG. Pages are spread over one
+# worker process per core.
+#
+#   python3 render.py https://example.org/ page.html
+#   python3 render.py --format png --output out/ $(cat urls.txt)
+
+MAX_PNG_HEIGHT = 32768
+DEFAULT_RULES = None
+
+def init_worker(fixed_fonts):
+    global DEFAULT_RULES
+    # Only the main process writes to stdout, or the status messages printed while
+    # loading a page end up in the middle of the JSON
+    sys.stdout = sys.stderr
+    # Workers leave through os._exit, which skips the atexit flush of the cache index
+    multiprocessing.util.Finalize(None, URL.response_cache.flush, exitpriority=0)
+    set_font_backend(HeadlessFonts(fixed=fixed_fonts))
+    DEFAULT_RULES = default_style_sheet()
+
+def to_url(arg):
+    # Anything that is not a URL is taken as a path to a local file
+    if re.match(r"^(view-source:)?[a-z]+:", arg):
+        return URL(arg)
+    return URL("file://" + os.path.abspath(arg))
+
+def render_page(arg, width):
+    url = to_url(arg)
+    nodes = load_dom(url)
+    rules = DEFAULT_RULES + load_stylesheets(nodes, url)
+    style(nodes, RuleIndex(sorted(rules, key=cascade_priority)))
+
+    document = DocumentLayout(nodes, width)
+    document.layout()
+    display_list = []
+    paint_tree(document, display_list)
+    return document, display_list
+
+def command_to_json(cmd):
+    if isinstance(cmd, DrawText):
+        font = cmd.font
+        return {
+            "type": "text",
+            "left": cmd.left, "top": cmd.top, "bottom": cmd.bottom,
+            "text": cmd.text,
+            "font": [font.size, font.weight, font.style],
+            "color": cmd.color,
+        }
+    elif isinstance(cmd, DrawImage):
+        return {
+            "type": "image",
+            "left": cmd.left, "top": cmd.top, "right": cmd.right, "bottom": cmd.bottom,
+            "name": cmd.name,
+        }
+    elif isinstance(cmd, DrawRect):
+        return {
+            "type": "rect",
+            "left": cmd.left, "top": cmd.top, "right": cmd.right, "bottom": cmd.bottom,
+            "color": cmd.color,
+        }
+
+def write_png(path, width, height, display_list):
+    from PIL import Image, ImageDraw, ImageFont
+    height = min(int(height), MAX_PNG_HEIGHT)
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    default_font = None
+
+    for cmd in display_list:
+        if cmd.top > height:
+            continue
+        try:
+            if isinstance(cmd, DrawRect):
+                draw.rectangle((cmd.left, cmd.top, cmd.right, cmd.bottom), fill=cmd.color)
+            elif isinstance(cmd, DrawText):
+                font = getattr(cmd.font, "font", None)
+                if font is None:
+                    # Fixed metrics fonts have nothing to draw with
+                    if default_font is None:
+                        default_font = ImageFont.load_default()
+                    font = default_font
+                draw.text((cmd.left, cmd.top), cmd.text, font=font, fill=cmd.color)
+            elif isinstance(cmd, DrawImage):
+                sprite = get_emoji_atlas().get_image(cmd.name)
+                if sprite:
+                    image.paste(sprite, (int(cmd.left), int(cmd.top)), sprite)
+        except ValueError:
+            # A CSS color Pillow does not know
+            continue
+    image.save(path)
+
+def output_name(index, arg):
+    name = re.sub(r"[^A-Za-z0-9._-]+", "_", arg)[-80:]
+    return f"{index:05d}-{name}"
+
+def render_job(job):
+    # Runs in a worker. Returns (arg, JSON result or None, error or None)
+    index, arg, width, format, output = job
+    try:
+        document, display_list = render_page(arg, width)
+        height = document.height + 2 * VSTEP
+
+        if format == "png":
+            path = os.path.join(output, output_name(index, arg) + ".png")
+            write_png(path, width, height, display_list)
+            return arg, None, None
+
+        result = {
+            "url": arg,
+            "width": width,
+            "height": height,
+            "display_list": [command_to_json(cmd) for cmd in display_list],
+        }
+        if output:
+            path = os.path.join(output, output_name(index, arg) + ".json")
+            with open(path, "w") as f:
+                json.dump(result, f)
+            return arg, None, None
+        return arg, result, None
+    except Exception as e:
+        return arg, None, f"{type(e).__name__}: {e}"
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Render pages without a display.")
+    parser.add_argument("pages", nargs="+", help="URLs or paths to local files")
+    parser.add_argument("--format", choices=["json", "png"], default="json")
+    parser.add_argument("--output", help="directory to write one file per page to, JSON goes to stdout without it")
+    parser.add_argument("--width", type=int, default=800)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--fixed-fonts", action="store_true", help="use fixed font metrics instead of Pillow fonts")
+    args = parser.parse_args(argv)
+
+    if args.format == "png" and not args.output:
+        parser.error("--format png needs --output")
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+
+    jobs = [(i, arg, args.width, args.format, args.output) for i, arg in enumerate(args.pages)]
+    failures = 0
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        initializer=init_worker,
+        initargs=(args.fixed_fonts,),
+    ) as executor:
+        # Results come back in input order, small chunks keep every worker busy
+        chunksize = max(1, len(jobs) // (4 * args.workers))
+        for arg, result, error in executor.map(render_job, jobs, chunksize=chunksize):
+            if error:
+                failures += 1
+                print(f"Error rendering {arg}: {error}", file=sys.stderr)
+            elif result:
+                print(json.dumps(result))
+
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,17 +1,17 @@
 from tkinter import *
 from tkinter import ttk
-import emoji
-import os
-from PIL import Image, ImageTk
 from .layout import DocumentLayout, paint_tree
-from .html_parser import HTMLParser
-from .css_parser import CSSParser,style, tree_to_list
-from .element import Element
+from .css_parser import CSSParser, RuleIndex, style, restyle, mark_tree_dirty
 from .tag_selector import cascade_priority
+from .page import load_dom, load_stylesheets, default_style_sheet
+from . import startup
+from .display_list import TiledDisplayList
+from .draw import DrawRect
 
 WIDTH, HEIGHT = 800, 600
 HSTEP, VSTEP = 13, 18
 SCROLL_STEP = 50
+RESIZE_DELAY = 100 # ms without Configure events before the page is laid out again
 
 class Browser:
 
@@ -48,9 +48,15 @@ class Browser:
         self.window.bind("<Button-5>", self.scrolldown)
         self.window.bind("<Configure>", self.resize)
 
-        self.emoji_cache = {}
+        self.resize_job = None
+        self.display_list = []
+        # Canvas items only exist for the tiles near the visible part of the page
+        self.tiles = TiledDisplayList()
+        # Rectangles are kept below this hidden item and text above it, so a tile
+        # created later does not cover the text of the tile above it
+        self.rect_layer = self.canvas.create_line(0, 0, 0, 0, state="hidden")
         self.rules = []
-        self.DEFAULT_STYLE_SHEET = CSSParser(open("browser.css").read()).parse()
+        self.DEFAULT_STYLE_SHEET = default_style_sheet()
 
     def total_height(self):
         if self.display_list:
@@ -59,61 +65,77 @@ class Browser:
 
     def on_scrollbar(self, *args):
         self.canvas.yview(*args)
+        self.paint_visible()
     
-    def get_emoji(self, char):
-        filename = "-".join(f"{ord(c):x}" for c in char)
-        filename = str.upper(filename)
-        filename += ".png"
-
-        path = os.path.join("OpenMoji", filename)
-
-        if not os.path.exists(path):
-            return None
-        elif path not in self.emoji_cache: 
-            image = Image.open(path)
-            resized_image = image.resize((16, 16))
-            img = ImageTk.PhotoImage(resized_image)
-            self.emoji_cache[path] = img
-        return self.emoji_cache[path]
-
     def load(self, url):
-        body = url.request()
-        self.nodes = HTMLParser(body, url.is_view_source).parse()
+        self.nodes = load_dom(url)
 
         # 1. Copy over the browsers default style-sheet
         #self.rules = self.DEFAULT_STYLE_SHEET.copy()
         self.rules = self.DEFAULT_STYLE_SHEET.copy()
-        # 2. Find and load external stylesheets
-        links = [node.attributes["href"]
-            for node in tree_to_list(self.nodes, [])
-            if isinstance(node, Element) 
-            and node.tag == "link"
-            and node.attributes.get("rel") == "stylesheet"
-            and "href" in node.attributes]
-        
-        # 3. For each link, resolve the CSS rule and append it to rules
-        for link in links:
-            style_url = url.resolve(link)
-            try:
-                body = style_url.request()
-            except:
-                continue
-            self.rules.extend(CSSParser(body).parse())
+        # 2. Find and load external stylesheets, 3. in document order
+        self.rules.extend(load_stylesheets(self.nodes, url))
 
         # 4. Apply all the CSS rules (default + external) to the DOM 
-        style(self.nodes, sorted(self.rules, key=cascade_priority)) #store style information to each node
+        self.rule_index = RuleIndex(sorted(self.rules, key=cascade_priority))
+        style(self.nodes, self.rule_index) #store style information to each node
+        startup.mark("style")
 
         self.document = DocumentLayout(self.nodes, self.width) # create DocumentLayout object, is parent to all BlockLayout's
+        self.render()
+
+    def add_stylesheet(self, body):
+        # A stylesheet that arrives after the page has been laid out. Everything is
+        # restyled, but only nodes whose style actually changed are laid out again.
+        self.rules.extend(CSSParser(body).parse())
+        self.rule_index = RuleIndex(sorted(self.rules, key=cascade_priority))
+        mark_tree_dirty(self.nodes)
+        self.render()
+
+    def render(self):
+        # Bring style, layout and the canvas up to date with the DOM. Clean parts of the
+        # tree are skipped by restyle and reused by the layout.
+        restyle(self.nodes, self.rule_index)
         self.document.layout()
+        startup.mark("layout")
         self.display_list = []
         paint_tree(self.document, self.display_list)
-        
-        self.canvas.delete("all")
+        self.tiles.update(self.display_list)
 
-        for cmd in self.display_list:
-            cmd.execute(0, self.canvas)  
-        
         self.draw()
+        self.paint_visible()
+        startup.mark("paint")
+
+    def paint_visible(self):
+        # Create the items of dirty tiles within a screen of the visible area and drop
+        # tiles that are more than two screens away
+        top = self.canvas.canvasy(0)
+        bottom = top + self.height
+        margin = self.height
+
+        keep = self.tiles.tile_range(top - 2 * margin, bottom + 2 * margin)
+        for tile in list(self.tiles.shown):
+            if tile.dirty or tile.index not in keep:
+                self.clear_tile(tile)
+
+        for index in self.tiles.tile_range(top - margin, bottom + margin):
+            tile = self.tiles.tiles.get(index)
+            if tile is None or not tile.dirty:
+                continue
+            for cmd in tile.commands:
+                item = cmd.execute(0, self.canvas)
+                if isinstance(cmd, DrawRect):
+                    self.canvas.tag_lower(item, self.rect_layer)
+                tile.items.append(item)
+            tile.dirty = False
+            self.tiles.shown.add(tile)
+
+    def clear_tile(self, tile):
+        if tile.items:
+            self.canvas.delete(*tile.items)
+        tile.items = []
+        tile.dirty = True
+        self.tiles.shown.discard(tile)
 
     def draw(self):
         self.canvas.config(scrollregion=(0, 0, self.width, self.total_height()))
@@ -123,21 +145,30 @@ class Browser:
 
         if first > 0.0:
             self.canvas.yview_scroll(-1, "units") 
+            self.paint_visible()
     
     def scrolldown(self, _):
         self.canvas.yview_scroll(1, "units")
+        self.paint_visible()
 
     def resize(self, e):
-        self.width = e.width
-        self.height = e.height
-        self.canvas.config(width=e.width, height=e.height)
-        
-        self.document = DocumentLayout(self.nodes, self.width)
-        self.document.layout()
-        self.display_list = []
-        paint_tree(self.document, self.display_list)
-
-        self.canvas.delete("all")
-        for cmd in self.display_list:
-            cmd.execute(0, self.canvas)
-        self.draw()
+        # Dragging the window sends a burst of Configure events, only lay out again
+        # once they stop coming
+        if self.resize_job is not None:
+            self.window.after_cancel(self.resize_job)
+        self.resize_job = self.window.after(RESIZE_DELAY, self.finish_resize, e.width, e.height)
+
+    def finish_resize(self, width, height):
+        self.resize_job = None
+        self.height = height
+        self.canvas.config(width=width, height=height)
+
+        if width == self.width:
+            # Height only, the layout stays as it is
+            self.draw()
+            self.paint_visible()
+            return
+
+        self.width = width
+        self.document.layout_width = self.width
+        self.render()
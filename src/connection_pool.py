@@ -0,0 +1,88 @@
+import socket
+import select
+import threading
+import time
+
+class ConnectionPool:
+    MAX_IDLE_PER_HOST = 6
+    IDLE_TIMEOUT = 30.0
+
+    def __init__(self, max_idle_per_host=MAX_IDLE_PER_HOST, idle_timeout=IDLE_TIMEOUT):
+        self.max_idle_per_host = max_idle_per_host
+        self.idle_timeout = idle_timeout
+        self.idle = {} # (scheme, host, port) -> list of (socket, time it was released)
+        self.ssl_context = None
+        self.lock = threading.Lock()
+
+    def acquire(self, scheme, host, port, fresh=False):
+        # Returns (socket, reused). Idle sockets are handed out most recently used first,
+        # fresh=True skips the idle list and always opens a new connection.
+        key = (scheme, host, port)
+
+        while not fresh:
+            with self.lock:
+                idle = self.idle.get(key)
+                if not idle:
+                    break
+                s, released_at = idle.pop()
+            if time.time() - released_at > self.idle_timeout or self.is_stale(s):
+                s.close()
+                continue
+            return s, True
+
+        return self.connect(scheme, host, port), False
+
+    def release(self, scheme, host, port, s):
+        # Hand a socket whose response was fully read back to the pool.
+        key = (scheme, host, port)
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            self.expire(idle)
+
+            if len(idle) >= self.max_idle_per_host:
+                oldest, _ = idle.pop(0)
+                oldest.close()
+            idle.append((s, time.time()))
+
+    def discard(self, s):
+        try:
+            s.close()
+        except OSError:
+            pass
+
+    def close_all(self):
+        with self.lock:
+            for idle in self.idle.values():
+                for s, _ in idle:
+                    s.close()
+            self.idle = {}
+
+    def expire(self, idle):
+        now = time.time()
+        while idle and now - idle[0][1] > self.idle_timeout:
+            s, _ = idle.pop(0)
+            s.close()
+
+    def is_stale(self, s):
+        # An idle keep-alive socket should have nothing to read. If it is readable the
+        # server has either closed it (EOF) or sent something we never asked for.
+        try:
+            readable, _, _ = select.select([s], [], [], 0)
+        except (OSError, ValueError):
+            return True
+        return bool(readable)
+
+    def connect(self, scheme, host, port):
+        s = socket.socket(
+            family=socket.AF_INET,
+            type=socket.SOCK_STREAM,
+            proto=socket.IPPROTO_TCP,
+        )
+        s.connect((host, port))
+
+        if scheme == "https":
+            import ssl
+            if self.ssl_context is None:
+                self.ssl_context = ssl.create_default_context()
+            s = self.ssl_context.wrap_socket(s, server_hostname=host)
+        return s
@@ -1,5 +1,6 @@
-from .element import Element
-from .tag_selector import TagSelector, DescendantSelector
+from types import MappingProxyType
+from .element import Element, mark_dirty
+from .tag_selector import TagSelector, DescendantSelector, AncestorFilter
 
 INHERITED_PROPERTIES = {
     "font-size": "16px",
@@ -110,50 +111,161 @@ class CSSParser:
                     break
         return rules
     
-def style(node, rules):
-    node.style = {}
+class RuleIndex:
+    # Rules bucketed by the tag their rightmost selector requires, so a node is only
+    # checked against rules that could match it. Selectors without such a tag go in
+    # the universal bucket. Candidates keep the order the rules were given in, which
+    # is the cascade order from cascade_priority.
+    def __init__(self, rules):
+        self.by_tag = {}
+        self.universal = []
+        for order, (selector, body) in enumerate(rules):
+            key = getattr(selector, "key", None)
+            if key is None:
+                self.universal.append((order, selector, body))
+            else:
+                self.by_tag.setdefault(key, []).append((order, selector, body))
+        self.merged = {}
+        self.dependent = {}
+
+        # Computed styles shared between nodes, see style()
+        self.shared_styles = {}
+
+    def candidates(self, node):
+        tag = node.tag if isinstance(node, Element) else None
+        if tag not in self.merged:
+            entries = sorted(self.by_tag.get(tag, []) + self.universal, key=lambda entry: entry[0])
+            self.merged[tag] = [(selector, body) for _, selector, body in entries]
+            # A plain tag selector matches every node in its bucket, only the other
+            # candidates depend on where in the tree the node is
+            self.dependent[tag] = [(i, selector) for i, (selector, body) in enumerate(self.merged[tag])
+                if not isinstance(selector, TagSelector)]
+        return self.merged[tag]
+
+def style(node, rules, ancestors=None):
+    if not isinstance(rules, RuleIndex):
+        rules = RuleIndex(rules)
+    if ancestors is None:
+        ancestors = AncestorFilter()
+
+    # Walk the tree in document order with an explicit stack, parents are always styled
+    # before their children. A tag on the stack marks the point where all children of an
+    # element with that tag are done and it has to leave the ancestor filter again.
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, str):
+            ancestors.pop(node)
+            continue
+
+        style_node(node, rules, ancestors)
+        node.style_dirty = False
+        if node.children:
+            if isinstance(node, Element):
+                ancestors.push(node.tag)
+                stack.append(node.tag)
+            stack.extend(reversed(node.children))
+
+def restyle(node, rules, ancestors=None):
+    # Like style(), but only visits nodes that are style dirty or have dirty nodes below
+    # them. A node whose computed style changed needs a relayout, and its children have
+    # to be restyled too since they inherit from it.
+    if not isinstance(rules, RuleIndex):
+        rules = RuleIndex(rules)
+    if ancestors is None:
+        ancestors = AncestorFilter()
+
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, str):
+            ancestors.pop(node)
+            continue
+
+        if node.style_dirty:
+            old_style = getattr(node, "style", None)
+            style_node(node, rules, ancestors)
+            node.style_dirty = False
+            if node.style != old_style:
+                mark_dirty(node)
+                for child in node.children:
+                    child.style_dirty = True
+                    node.children_dirty = True
+
+        if node.children_dirty:
+            if isinstance(node, Element):
+                ancestors.push(node.tag)
+                stack.append(node.tag)
+            stack.extend(reversed(node.children))
+
+def mark_tree_dirty(node):
+    # Everything has to be restyled, for example after a new stylesheet arrived
+    for node in iter_tree(node):
+        node.style_dirty = True
+        if node.children:
+            node.children_dirty = True
+
+def style_node(node, rules, ancestors):
+    # Nodes with the same parent style, tag, matching rules and inline style end up with
+    # the same computed style, so they share one read-only copy. Each entry keeps its
+    # parent style alive, so an id in a key can never be reused by another style.
+    parent_style = node.parent.style if node.parent else None
+    is_element = isinstance(node, Element)
+    tag = node.tag if is_element else None
+    candidates = rules.candidates(node)
+    dependent = rules.dependent[tag]
+    matched = tuple(i for i, selector in dependent if selector.matches(node, ancestors)) if dependent else ()
+    inline = node.attributes.get("style") if is_element else None
+
+    key = (id(parent_style), tag, matched, inline)
+    shared = rules.shared_styles.get(key)
+    if shared is None:
+        shared = (parent_style, compute_style(parent_style, candidates, matched, inline))
+        rules.shared_styles[key] = shared
+    node.style = shared[1]
+
+def compute_style(parent_style, candidates, matched, inline):
+    computed = {}
     for property, default_value in INHERITED_PROPERTIES.items():
-        if node.parent:
-            node.style[property] = node.parent.style[property]
+        if parent_style:
+            computed[property] = parent_style[property]
         else:
-            node.style[property] = default_value
+            computed[property] = default_value
 
-    for selector, body in rules:
-        if not selector.matches(node): 
+    for i, (selector, body) in enumerate(candidates):
+        if not isinstance(selector, TagSelector) and i not in matched:
             continue
         for property, value in body.items():
-            node.style[property] = value
+            computed[property] = value
 
-    if isinstance(node, Element) and "style" in node.attributes:
-        pairs = CSSParser(node.attributes["style"]).body()
+    if inline is not None:
+        pairs = CSSParser(inline).body()
 
         for property, value in pairs.items():
-            node.style[property] = value 
+            computed[property] = value 
     
-    if node.style["font-size"].endswith("%"):
+    if computed["font-size"].endswith("%"):
         # all nodes inherit their parents font-size
-        if node.parent:
-            parent_font_size = node.parent.style["font-size"]
+        if parent_style:
+            parent_font_size = parent_style["font-size"]
         else:
             parent_font_size = INHERITED_PROPERTIES["font-size"]
         # example: 120% --> remove trailing % then divide by 100 gives 1.2 
-        node_pct = float(node.style["font-size"][:-1]) / 100
+        node_pct = float(computed["font-size"][:-1]) / 100
         # example: 16px --> remove trailing px gives 16.0
         parent_px = float(parent_font_size[:-2])
-        node.style["font-size"] = str(node_pct * parent_px) + "px"
-        
-    for child in node.children:
-        style(child, rules)
+        computed["font-size"] = str(node_pct * parent_px) + "px"
 
-def tree_to_list(tree, list):
-    list.append(tree)
+    return MappingProxyType(computed)
 
-    for child in tree.children:
-        tree_to_list(child, list)
+def iter_tree(tree):
+    # Yields every node of the tree in document order, without building a list
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(reversed(node.children))
 
+def tree_to_list(tree, list):
+    list.extend(iter_tree(tree))
     return list
-
-
-        
-
-
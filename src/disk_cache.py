@@ -0,0 +1,283 @@
+import atexit
+import hashlib
+import json
+import mmap
+import os
+import threading
+import time
+from collections import OrderedDict
+try:
+    import fcntl
+except ImportError: # Windows, flushes are then not serialized between processes
+    fcntl = None
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "web-browser")
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+def has_validators(headers):
+    return "etag" in headers or "last-modified" in headers
+
+# Writes only change the index in memory. It is written to disk in batches: when
+# the cache compacts, when FLUSH_DELAY seconds have passed since the last flush,
+# and at exit. Compacting looks at every entry, so it waits for as many writes as
+# there are entries, at least COMPACT_INTERVAL.
+#
+# Several processes may share a cache directory, render.py workers do. Temporary
+# files carry the pid, flush merges in entries other processes wrote since while
+# holding index.lock, and compact leaves alone objects the index on disk refers to
+# or that are younger than COMPACT_GRACE seconds, as their index entry may not have
+# been written yet.
+
+class DiskCache:
+    COMPACT_INTERVAL = 64
+    COMPACT_GRACE = 60
+    FLUSH_DELAY = 5
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory or os.environ.get("WEB_BROWSER_CACHE_DIR", DEFAULT_CACHE_DIR)
+        self.objects = os.path.join(self.directory, "objects")
+        self.index_path = os.path.join(self.directory, "index.json")
+        self.lock_path = os.path.join(self.directory, "index.lock")
+        self.max_bytes = max_bytes
+
+        # url -> {"hash", "size", "headers", "expires"}, least recently used first.
+        # Only the index is kept in memory, bodies stay on disk until they are hit.
+        self.index = None
+        self.refs = {} # hash -> number of entries with that body
+        self.total_bytes = 0
+        self.dirty = False
+        self.writes = 0
+        self.flushed_at = time.time()
+        self.removed = set() # keys removed since the last flush, not to be merged back in
+        self.lock = threading.RLock()
+        atexit.register(self.flush)
+
+    # The cache is only ever an optimization: get, put and refresh report I/O errors
+    # and carry on as a miss or a skipped store instead of failing the request.
+
+    def get(self, key):
+        try:
+            return self.lookup(key)
+        except OSError as e:
+            print(f"Error reading cache: {e}")
+            return None
+
+    def lookup(self, key):
+        with self.lock:
+            self.load_index()
+            entry = self.index.get(key)
+            if entry is None:
+                return None
+
+            # Stale entries are kept if they can be revalidated with a conditional request
+            if time.time() >= entry["expires"] and not has_validators(entry["headers"]):
+                print("Time expired, removing cached object")
+                self.remove(key)
+                return None
+
+            content = self.read_object(entry["hash"])
+            if content is None:
+                # Object file went missing behind our back
+                self.remove(key)
+                return None
+
+            self.index.move_to_end(key)
+            self.dirty = True
+            return {
+                "headers": entry["headers"],
+                "content": content,
+                "expires": entry["expires"],
+            }
+
+    def put(self, key, headers, content, expires):
+        try:
+            self.store(key, headers, content, expires)
+        except OSError as e:
+            print(f"Error writing cache: {e}")
+
+    def store(self, key, headers, content, expires):
+        data = content.encode("utf-8")
+        if len(data) > self.max_bytes:
+            return
+        digest = hashlib.sha256(data).hexdigest()
+
+        with self.lock:
+            self.load_index()
+            # Removed first, the old entry may have the same body as the new one
+            if key in self.index:
+                self.remove(key)
+            self.write_object(digest, data)
+
+            self.add(key, {
+                "hash": digest,
+                "size": len(data),
+                "headers": headers,
+                "expires": expires,
+            })
+            self.evict()
+            self.wrote()
+
+    def refresh(self, key, headers, expires):
+        # Give an entry new headers and lifetime after a 304, without touching its body
+        with self.lock:
+            try:
+                self.load_index()
+            except OSError as e:
+                print(f"Error reading cache: {e}")
+                return
+            entry = self.index.get(key)
+            if entry is None:
+                return
+            entry["headers"] = headers
+            entry["expires"] = expires
+            self.index.move_to_end(key)
+            self.wrote()
+
+    def wrote(self):
+        # Called after every write, flushes the index when a batch is due
+        self.dirty = True
+        self.writes += 1
+        if self.writes >= max(self.COMPACT_INTERVAL, len(self.index)):
+            self.writes = 0
+            self.compact()
+            self.flush()
+        elif time.time() - self.flushed_at >= self.FLUSH_DELAY:
+            self.flush()
+
+    def add(self, key, entry):
+        # Insert an entry as the most recently used one
+        self.index[key] = entry
+        self.refs[entry["hash"]] = self.refs.get(entry["hash"], 0) + 1
+        self.total_bytes += entry["size"]
+
+    def remove(self, key):
+        with self.lock:
+            self.load_index()
+            entry = self.index.pop(key, None)
+            if entry is None:
+                return
+            self.removed.add(key)
+            self.total_bytes -= entry["size"]
+            self.dirty = True
+
+            # Bodies are content-addressed, so only delete the file once nothing refers to it
+            self.refs[entry["hash"]] -= 1
+            if not self.refs[entry["hash"]]:
+                del self.refs[entry["hash"]]
+                try:
+                    os.remove(self.object_path(entry["hash"]))
+                except OSError:
+                    pass
+
+    def evict(self):
+        # Drop least recently used entries until we are back under the byte budget
+        while self.total_bytes > self.max_bytes and self.index:
+            key = next(iter(self.index))
+            self.remove(key)
+
+    def compact(self):
+        # Drop expired entries that cannot be revalidated and any object files no longer referenced by the index
+        with self.lock:
+            self.load_index()
+            now = time.time()
+            expired = [key for key, entry in self.index.items()
+                if now >= entry["expires"] and not has_validators(entry["headers"])]
+            for key in expired:
+                self.remove(key)
+
+            referenced = set(self.refs)
+            referenced.update(entry["hash"] for key, entry in self.read_index())
+            try:
+                names = os.listdir(self.objects)
+            except OSError:
+                names = []
+            for name in names:
+                if name in referenced:
+                    continue
+                path = os.path.join(self.objects, name)
+                try:
+                    if now - os.path.getmtime(path) > self.COMPACT_GRACE:
+                        os.remove(path)
+                except OSError:
+                    pass
+            self.dirty = True
+
+    def clear(self):
+        with self.lock:
+            self.load_index()
+            for key in list(self.index):
+                self.remove(key)
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if not self.dirty or self.index is None:
+                return
+            self.flushed_at = time.time()
+            try:
+                with open(self.lock_path, "w") as lock_file:
+                    if fcntl:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX) # released when the file is closed
+                    self.write_index()
+                self.dirty = False
+            except OSError as e:
+                print(f"Error writing cache index: {e}")
+
+    def write_index(self):
+        # Entries another process added since we read the index, as least recently used
+        for key, entry in reversed(self.read_index()):
+            if key not in self.index and key not in self.removed:
+                self.add(key, entry)
+                self.index.move_to_end(key, last=False)
+        self.evict()
+        self.removed = set()
+
+        # json.dumps uses the C encoder, json.dump writes piece by piece in Python
+        data = json.dumps([[key, entry] for key, entry in self.index.items()])
+        tmp_path = f"{self.index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(data)
+        os.replace(tmp_path, self.index_path)
+
+    def load_index(self):
+        if self.index is not None:
+            return
+
+        # Raises OSError if the directory cannot be created, the index is then loaded
+        # again on the next call
+        os.makedirs(self.objects, exist_ok=True)
+        self.index = OrderedDict()
+        for key, entry in self.read_index():
+            self.add(key, entry)
+        self.compact()
+        self.evict()
+
+    def read_index(self):
+        # [[key, entry], ...] as last written to disk by any process
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    def object_path(self, digest):
+        return os.path.join(self.objects, digest)
+
+    def write_object(self, digest, data):
+        path = self.object_path(digest)
+        if os.path.exists(path):
+            return
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def read_object(self, digest):
+        try:
+            with open(self.object_path(digest), "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return ""
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as body:
+                    return str(body, "utf-8")
+        except OSError:
+            return None
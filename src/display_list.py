@@ -0,0 +1,69 @@
+from .draw import DrawRect
+
+TILE_HEIGHT = 256
+
+class Tile:
+    def __init__(self, index):
+        self.index = index
+        self.commands = []
+        # Canvas items of the commands, empty while the tile is not on the canvas.
+        # dirty means the items are missing or out of date.
+        self.items = []
+        self.dirty = True
+
+class TiledDisplayList:
+    # The display list cut into fixed-height tiles, so painting and scrolling work
+    # on the few tiles in view instead of every command. Text belongs to the tile
+    # its top is in, rectangles are clipped into a piece for every tile they cover.
+
+    def __init__(self, tile_height=TILE_HEIGHT):
+        self.tile_height = tile_height
+        self.tiles = {} # tile index -> Tile
+        self.shown = set() # tiles with canvas items
+
+    def update(self, display_list):
+        # Spread a freshly painted display list over the tiles. A tile whose commands
+        # are not the same as before is marked dirty, the rest keep their items.
+        commands = {}
+        for cmd in display_list:
+            for index, piece in self.split(cmd):
+                commands.setdefault(index, []).append(piece)
+
+        for index in list(self.tiles):
+            if index in commands:
+                continue
+            tile = self.tiles[index]
+            if tile in self.shown:
+                # Still has items to be deleted
+                tile.commands = []
+                tile.dirty = True
+            else:
+                del self.tiles[index]
+
+        for index, tile_commands in commands.items():
+            tile = self.tiles.get(index)
+            if tile is None:
+                tile = self.tiles[index] = Tile(index)
+            if tile.commands != tile_commands:
+                tile.commands = tile_commands
+                tile.dirty = True
+
+    def split(self, cmd):
+        first = int(cmd.top // self.tile_height)
+        if not isinstance(cmd, DrawRect):
+            return [(first, cmd)]
+
+        last = int((cmd.bottom - 1) // self.tile_height)
+        if first >= last:
+            return [(first, cmd)]
+        pieces = []
+        for index in range(first, last + 1):
+            top = max(cmd.top, index * self.tile_height)
+            bottom = min(cmd.bottom, (index + 1) * self.tile_height)
+            pieces.append((index, DrawRect(cmd.left, top, cmd.right, bottom, cmd.color)))
+        return pieces
+
+    def tile_range(self, top, bottom):
+        # Indices of the tiles that can have something between top and bottom. Text
+        # can hang over into the next tile, so the tile above is included.
+        return range(int(top // self.tile_height) - 1, int(bottom // self.tile_height) + 1)
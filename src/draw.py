@@ -1,14 +1,24 @@
+from .emoji_atlas import get_emoji_atlas
+
 class DrawText:
-    def __init__(self, x1, y1, text, font, color):
+    def __init__(self, x1, y1, text, font, color, linespace=None):
         self.top = y1
         self.left = x1
         self.text = text
         self.font = font
         self.color = color
-        self.bottom = y1 + font.metrics("linespace")
+        if linespace is None:
+            linespace = font.metrics("linespace")
+        self.bottom = y1 + linespace
+
+    def __eq__(self, other):
+        return isinstance(other, DrawText) and \
+            (self.left, self.top, self.bottom, self.text, self.color) == \
+            (other.left, other.top, other.bottom, other.text, other.color) and \
+            self.font is other.font
     
     def execute(self, scroll, canvas):
-        canvas.create_text(
+        return canvas.create_text(
             self.left, self.top - scroll, 
             text=self.text,
             font=self.font,
@@ -16,6 +26,27 @@ class DrawText:
             fill=self.color
         )
 
+class DrawImage:
+    # An emoji from the atlas, drawn as a size x size box
+    def __init__(self, x1, y1, name, size):
+        self.top = y1
+        self.left = x1
+        self.name = name
+        self.bottom = y1 + size
+        self.right = x1 + size
+
+    def __eq__(self, other):
+        return isinstance(other, DrawImage) and \
+            (self.left, self.top, self.name, self.bottom) == \
+            (other.left, other.top, other.name, other.bottom)
+
+    def execute(self, scroll, canvas):
+        return canvas.create_image(
+            self.left, self.top - scroll,
+            image=get_emoji_atlas().get_photo(self.name),
+            anchor="nw"
+        )
+
 class DrawRect:
     def __init__(self, x1, y1, x2, y2, color):
         self.top = y1
@@ -24,8 +55,13 @@ class DrawRect:
         self.right = x2
         self.color = color
 
+    def __eq__(self, other):
+        return isinstance(other, DrawRect) and \
+            (self.left, self.top, self.right, self.bottom, self.color) == \
+            (other.left, other.top, other.right, other.bottom, other.color)
+
     def execute(self, scroll, canvas):
-        canvas.create_rectangle(
+        return canvas.create_rectangle(
             self.left, self.top - scroll, 
             self.right, self.bottom - scroll,
             width=0,
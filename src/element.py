@@ -1,9 +1,57 @@
+import sys
+from types import MappingProxyType
+
+# Shared by every element without attributes and every leaf without children,
+# both are read-only so they can never be modified by accident
+NO_ATTRIBUTES = MappingProxyType({})
+NO_CHILDREN = ()
+
 class Element:
+    __slots__ = (
+        "tag", "attributes", "children", "parent", "style",
+        "style_dirty", "layout_dirty", "children_dirty",
+    )
+
     def __init__(self, tag, attributes, parent):
-        self.tag = tag
-        self.children = []
-        self.attributes = attributes
+        self.tag = sys.intern(tag)
+        self.children = NO_CHILDREN
+        if attributes:
+            self.attributes = {sys.intern(key): value for key, value in attributes.items()}
+        else:
+            self.attributes = NO_ATTRIBUTES
         self.parent = parent
+
+        # A new node has never been styled or laid out
+        self.style_dirty = True
+        self.layout_dirty = True
+        self.children_dirty = True
+
+    def append_child(self, node):
+        # The children list is only created once the element gets its first child
+        if self.children is NO_CHILDREN:
+            self.children = [node]
+        else:
+            self.children.append(node)
+        self.layout_dirty = True
+        mark_dirty(node)
+
+    def set_attribute(self, key, value):
+        if self.attributes is NO_ATTRIBUTES:
+            self.attributes = {}
+        self.attributes[sys.intern(key)] = value
+        mark_dirty(self, style=True)
     
     def __repr__(self):
-        return "<" + self.tag + ">"
\ No newline at end of file
+        return "<" + self.tag + ">"
+
+def mark_dirty(node, style=False):
+    # Flag a node for relayout (and restyle) and let its ancestors know that something
+    # below them changed. Clean subtrees are skipped by restyle() and layout().
+    if style:
+        node.style_dirty = True
+    node.layout_dirty = True
+
+    parent = node.parent
+    while parent is not None and not parent.children_dirty:
+        parent.children_dirty = True
+        parent = parent.parent
@@ -0,0 +1,262 @@
+import json
+import mmap
+import os
+import re
+from .disk_cache import DEFAULT_CACHE_DIR
+
+EMOJI_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "assets", "OpenMoji")
+EMOJI_SIZE = 16
+MANIFEST_VERSION = 1
+VARIATION_SELECTOR = "\ufe0f"
+
+# Instead of looking for and decoding a PNG per emoji, every emoji in assets/OpenMoji
+# is resized once and packed into an atlas of raw RGBA sprites, one after the other.
+# A manifest lists the file names in atlas order and the directory mtime it was built
+# from. Both live in the cache directory and are only rebuilt when the emoji directory
+# changes. The atlas is memory-mapped and a sprite is only turned into an image when
+# it is first drawn.
+
+class EmojiAtlas:
+    def __init__(self, directory=EMOJI_DIR, cache_directory=None, size=EMOJI_SIZE):
+        self.directory = directory
+        cache_directory = cache_directory or os.path.join(
+            os.environ.get("WEB_BROWSER_CACHE_DIR", DEFAULT_CACHE_DIR), "emoji")
+        self.manifest_path = os.path.join(cache_directory, f"manifest-{size}.json")
+        self.atlas_path = os.path.join(cache_directory, f"atlas-{size}.rgba")
+        self.sequences_path = os.path.join(cache_directory, f"sequences-{size}.json")
+        self.size = size
+        self.sprite_bytes = size * size * 4
+
+        self.index = None # emoji sequence -> sprite number
+        self.mtime = None
+        self.atlas = None
+        self.images = {} # sprite number -> PIL image
+        self.photos = {} # emoji sequence -> Tk image
+
+    def load(self):
+        if self.index is not None:
+            return
+        self.index = {}
+        try:
+            mtime = os.stat(self.directory).st_mtime_ns
+        except OSError:
+            print(f"No emoji found in {self.directory}")
+            return
+        self.mtime = mtime
+
+        names = self.read_manifest(mtime)
+        if names is None:
+            try:
+                names = self.build(mtime)
+            except ImportError:
+                print("Pillow is needed to build the emoji atlas")
+                return
+
+        for slot, name in enumerate(names):
+            sequence = name_to_sequence(name)
+            self.index[sequence] = slot
+        # Text often leaves out the emoji variation selector the file names have
+        for sequence, slot in list(self.index.items()):
+            self.index.setdefault(sequence.replace(VARIATION_SELECTOR, ""), slot)
+
+        try:
+            with open(self.atlas_path, "rb") as f:
+                self.atlas = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            print("Emoji atlas could not be opened")
+            self.index = {}
+
+    def read_manifest(self, mtime):
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+            size = os.path.getsize(self.atlas_path)
+        except (OSError, ValueError):
+            return None
+        if manifest.get("version") != MANIFEST_VERSION or manifest.get("mtime") != mtime:
+            return None
+        if size != len(manifest["names"]) * self.sprite_bytes:
+            return None
+        return manifest["names"]
+
+    def build(self, mtime):
+        from PIL import Image
+        print("Building emoji atlas")
+        names = []
+        for filename in sorted(os.listdir(self.directory)):
+            name, extension = os.path.splitext(filename)
+            if extension.lower() == ".png" and name_to_sequence(name):
+                names.append(name)
+
+        os.makedirs(os.path.dirname(self.atlas_path), exist_ok=True)
+        tmp_path = f"{self.atlas_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            for name in names:
+                try:
+                    with Image.open(os.path.join(self.directory, name + ".png")) as image:
+                        sprite = image.convert("RGBA").resize((self.size, self.size))
+                    f.write(sprite.tobytes())
+                except (OSError, ValueError):
+                    # Keep the slot so the sprite numbers still line up
+                    f.write(bytes(self.sprite_bytes))
+        os.replace(tmp_path, self.atlas_path)
+
+        # The manifest is written last, it is what says the atlas is complete
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": MANIFEST_VERSION, "mtime": mtime, "names": names}, f)
+        os.replace(tmp_path, self.manifest_path)
+        return names
+
+    def lookup(self, sequence):
+        # Sprite number of an emoji, with or without variation selectors
+        self.load()
+        slot = self.index.get(sequence)
+        if slot is None and VARIATION_SELECTOR in sequence:
+            slot = self.index.get(sequence.replace(VARIATION_SELECTOR, ""))
+        return slot
+
+    def read_sequences(self):
+        # The emoji_sequences of this atlas from an earlier run
+        self.load()
+        try:
+            with open(self.sequences_path) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if cached.get("version") != MANIFEST_VERSION or cached.get("mtime") != self.mtime:
+            return None
+        return cached["sequences"]
+
+    def write_sequences(self, sequences):
+        tmp_path = f"{self.sequences_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump({"version": MANIFEST_VERSION, "mtime": self.mtime, "sequences": sequences}, f)
+            os.replace(tmp_path, self.sequences_path)
+        except OSError as e:
+            print(f"Error writing emoji sequences: {e}")
+
+    def has(self, sequence):
+        return self.lookup(sequence) is not None
+
+    def sequences(self):
+        self.load()
+        return self.index.keys()
+
+    def get_photo(self, sequence):
+        # The same image as a Tk PhotoImage, needs a Tk root
+        if sequence not in self.photos:
+            from PIL import ImageTk
+            image = self.get_image(sequence)
+            self.photos[sequence] = ImageTk.PhotoImage(image) if image else None
+        return self.photos[sequence]
+
+    def get_image(self, sequence):
+        # 16x16 RGBA PIL image of an emoji, None if there is no such emoji
+        slot = self.lookup(sequence)
+        if slot is None:
+            return None
+        if slot not in self.images:
+            from PIL import Image
+            offset = slot * self.sprite_bytes
+            data = self.atlas[offset:offset + self.sprite_bytes]
+            self.images[slot] = Image.frombytes("RGBA", (self.size, self.size), data)
+        return self.images[slot]
+
+def name_to_sequence(name):
+    # "1F468-200D-1F4BB" -> "\U0001F468\u200d\U0001F4BB", "" for names that are not code points
+    try:
+        return "".join(chr(int(code, 16)) for code in name.split("-"))
+    except ValueError:
+        return ""
+
+class EmojiMatcher:
+    # Splits text into text runs and emoji. A text is searched once for any character
+    # an emoji can start with, and only there the longest emoji is looked up.
+
+    def __init__(self, sequences):
+        self.sequences = set(sequences)
+        self.longest = max([len(sequence) for sequence in self.sequences], default=0)
+        starts = {sequence[0] for sequence in self.sequences}
+        self.start = re.compile(character_class(starts)) if starts else None
+
+    def has_emoji(self, text):
+        # Every emoji has a character outside ASCII, even keycaps like "1\ufe0f\u20e3"
+        if text.isascii() or self.start is None:
+            return False
+        return self.start.search(text) is not None
+
+    def split(self, text):
+        # [(is_emoji, piece), ...] covering the whole text in order
+        pieces = []
+        pos = 0
+        if self.start is None:
+            return [(False, text)]
+        for match in self.start.finditer(text):
+            i = match.start()
+            if i < pos:
+                continue
+            for length in range(min(self.longest, len(text) - i), 0, -1):
+                if text[i:i + length] in self.sequences:
+                    break
+            else:
+                continue
+            end = i + length
+            # A variation selector after an emoji that does not need one
+            if text[end:end + 1] == VARIATION_SELECTOR:
+                end += 1
+            if pos < i:
+                pieces.append((False, text[pos:i]))
+            pieces.append((True, text[i:end]))
+            pos = end
+        if pos < len(text):
+            pieces.append((False, text[pos:]))
+        return pieces
+
+def character_class(chars):
+    # A regex character class made of ranges, a long list of single characters is slow to match
+    codes = sorted(ord(char) for char in chars)
+    ranges = []
+    for code in codes:
+        if ranges and code == ranges[-1][1] + 1:
+            ranges[-1][1] = code
+        else:
+            ranges.append([code, code])
+    parts = [re.escape(chr(first)) if first == last else f"{re.escape(chr(first))}-{re.escape(chr(last))}"
+        for first, last in ranges]
+    return "[" + "".join(parts) + "]"
+
+def emoji_sequences(atlas):
+    # The emoji that are drawn from the atlas. The atlas also has plain characters like
+    # "-" and "©" that should stay text, the emoji package knows which sequences are
+    # meant as emoji. Without it we settle for the pictographs from U+1F000 up.
+    # Importing emoji takes longer than a first paint, so its answer is cached with the atlas.
+    sequences = atlas.read_sequences()
+    if sequences is not None:
+        return sequences
+    try:
+        import emoji
+    except ImportError:
+        return [sequence for sequence in atlas.sequences() if ord(sequence[0]) >= 0x1F000]
+
+    wanted = [emoji.STATUS["fully_qualified"], emoji.STATUS["minimally_qualified"], emoji.STATUS["component"]]
+    sequences = [sequence for sequence, data in emoji.EMOJI_DATA.items()
+        if data["status"] in wanted and atlas.has(sequence)]
+    atlas.write_sequences(sequences)
+    return sequences
+
+EMOJI_ATLAS = None
+EMOJI_MATCHER = None
+
+def get_emoji_atlas():
+    global EMOJI_ATLAS
+    if EMOJI_ATLAS is None:
+        EMOJI_ATLAS = EmojiAtlas()
+    return EMOJI_ATLAS
+
+def get_emoji_matcher():
+    global EMOJI_MATCHER
+    if EMOJI_MATCHER is None:
+        EMOJI_MATCHER = EmojiMatcher(emoji_sequences(get_emoji_atlas()))
+    return EMOJI_MATCHER
@@ -0,0 +1,57 @@
+import codecs
+import mmap
+import os
+import re
+from .http_stream import CHUNK_SIZE, iter_decoded
+
+# How far into a file we look for a byte order mark or <meta charset>
+SNIFF_BYTES = 4096
+
+BOMS = [
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+# Matches both <meta charset="..."> and <meta http-equiv=... content="text/html; charset=...">
+META_CHARSET = re.compile(rb"""<meta[^>]*?charset\s*=\s*["']?\s*([A-Za-z0-9_.:-]+)""", re.IGNORECASE)
+
+def sniff_charset(head):
+    # Charset of a document from its first bytes, None if it does not say
+    for bom, charset in BOMS:
+        if head.startswith(bom):
+            return charset
+
+    match = META_CHARSET.search(head)
+    if match:
+        try:
+            charset = codecs.lookup(match.group(1).decode("ascii")).name
+        except LookupError:
+            return None
+        # A page that could declare its charset in ASCII bytes is not UTF-16
+        if charset.startswith("utf-16"):
+            return "utf-8"
+        return charset
+    return None
+
+def iter_file(path):
+    # Yields the text of a file chunk by chunk. The file is memory-mapped and decoded
+    # as it is read, so only the chunk being decoded has to be in memory.
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if hasattr(data, "madvise"):
+                data.madvise(mmap.MADV_SEQUENTIAL)
+            charset = sniff_charset(data[:SNIFF_BYTES])
+            yield from iter_decoded(iter_chunks(data, size), charset)
+
+def iter_chunks(data, size):
+    # Pages that have been decoded are handed back right away, or a big file would
+    # stay mapped in full until the end. CHUNK_SIZE is a multiple of the page size.
+    release = hasattr(data, "madvise") and hasattr(mmap, "MADV_DONTNEED")
+    for start in range(0, size, CHUNK_SIZE):
+        yield data[start:start + CHUNK_SIZE]
+        if release:
+            data.madvise(mmap.MADV_DONTNEED, start, min(CHUNK_SIZE, size - start))
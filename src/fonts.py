@@ -0,0 +1,132 @@
+from collections import OrderedDict
+
+# Layout only needs two things from a font: measure(text) and metrics(name=None),
+# the same interface as tkinter.font.Font. Fonts come from a backend so the layout
+# can run without a Tk root, for batch rendering and benchmarks.
+
+class TkFonts:
+    # Real Tk fonts, needs a display
+    def create_font(self, size, weight, style):
+        import tkinter
+        import tkinter.font
+        font = tkinter.font.Font(size=size, weight=weight, slant=style)
+        # Tk forgets fonts nothing refers to, a label keeps it alive
+        font.label = tkinter.Label(font=font)
+        return font
+
+class FixedFont:
+    # Deterministic metrics, every character has the same advance
+    def __init__(self, size, weight, style):
+        self.size = size
+        self.weight = weight
+        self.style = style
+        pixels = max(1, round(abs(size) / 0.75))
+        self.advance = pixels * (0.6 if weight == "bold" else 0.55)
+        self.ascent = round(pixels * 0.8)
+        self.descent = round(pixels * 0.2)
+
+    def measure(self, text):
+        return round(len(text) * self.advance)
+
+    def metrics(self, name=None):
+        metrics = {
+            "ascent": self.ascent,
+            "descent": self.descent,
+            "linespace": self.ascent + self.descent,
+            "fixed": 1,
+        }
+        return metrics[name] if name else metrics
+
+    def __repr__(self):
+        return f"FixedFont({self.size}, {self.weight}, {self.style})"
+
+class PillowFont:
+    FILES = {
+        ("normal", "roman"): "DejaVuSans.ttf",
+        ("bold", "roman"): "DejaVuSans-Bold.ttf",
+        ("normal", "italic"): "DejaVuSans-Oblique.ttf",
+        ("bold", "italic"): "DejaVuSans-BoldOblique.ttf",
+    }
+
+    def __init__(self, size, weight, style):
+        from PIL import ImageFont
+        self.size = size
+        self.weight = weight
+        self.style = style
+        pixels = max(1, round(abs(size) / 0.75))
+        try:
+            self.font = ImageFont.truetype(self.FILES[(weight, style)], pixels)
+        except OSError:
+            self.font = ImageFont.load_default(pixels)
+        self.ascent, self.descent = self.font.getmetrics()
+
+    def measure(self, text):
+        return round(self.font.getlength(text))
+
+    def metrics(self, name=None):
+        metrics = {
+            "ascent": self.ascent,
+            "descent": self.descent,
+            "linespace": self.ascent + self.descent,
+            "fixed": 0,
+        }
+        return metrics[name] if name else metrics
+
+    def __repr__(self):
+        return f"PillowFont({self.size}, {self.weight}, {self.style})"
+
+class HeadlessFonts:
+    # Pillow's FreeType fonts when they can be loaded, fixed metrics otherwise
+    def __init__(self, fixed=False):
+        self.fixed = fixed
+
+    def create_font(self, size, weight, style):
+        if not self.fixed:
+            try:
+                return PillowFont(size, weight, style)
+            except (ImportError, OSError):
+                print("Pillow fonts unavailable, using fixed font metrics")
+                self.fixed = True
+        return FixedFont(size, weight, style)
+
+BACKEND = TkFonts()
+FONTS = {}
+# Measurements shared by every layout in the process. Word widths are keyed by
+# (font key, word) and bounded, the per font metrics are few and kept forever.
+WORD_WIDTHS = OrderedDict()
+WORD_WIDTHS_SIZE = 100000
+FONT_METRICS = {}
+
+def set_font_backend(backend):
+    # Fonts and measurements of the old backend are no good anymore
+    global BACKEND
+    BACKEND = backend
+    FONTS.clear()
+    WORD_WIDTHS.clear()
+    FONT_METRICS.clear()
+
+def get_font(size, weight, style):
+    key = (size, weight, style)
+    if key not in FONTS:
+        FONTS[key] = BACKEND.create_font(size, weight, style)
+    return FONTS[key]
+
+def get_word_width(key, font, word):
+    # key is the (size, weight, style) font was created with
+    cache_key = (key, word)
+    width = WORD_WIDTHS.get(cache_key)
+    if width is None:
+        width = font.measure(word)
+        WORD_WIDTHS[cache_key] = width
+        if len(WORD_WIDTHS) > WORD_WIDTHS_SIZE:
+            WORD_WIDTHS.popitem(last=False)
+    else:
+        WORD_WIDTHS.move_to_end(cache_key)
+    return width
+
+def get_font_metrics(key, font):
+    # (space width, ascent, descent, linespace) of a font
+    if key not in FONT_METRICS:
+        metrics = font.metrics()
+        FONT_METRICS[key] = (font.measure(" "), metrics["ascent"], metrics["descent"], metrics["linespace"])
+    return FONT_METRICS[key]
@@ -1,6 +1,25 @@
+import re
 from .text import Text
 from .element import Element
 
+# One token of markup: a run of text, a comment, or a tag whose quoted
+# attribute values may contain ">". A quote only starts a value right after "=",
+# so apostrophes elsewhere are plain characters. The last two alternatives are
+# what the reference tokenizer does when a value is never closed: the tag ends at
+# the first ">", and a "<" followed by another "<" before any ">" starts text.
+TOKEN = re.compile(r"""
+    ([^<]+)
+  | <!--(.*?)-->
+  | <([^<>=]*(?:=\s*(?:"[^"]*"|'[^']*'|(?![\s"']))[^<>=]*)*)>
+  | <([^<>]*)>
+  | <([^<>]*)(?=<)
+""", re.DOTALL | re.VERBOSE)
+OPEN_QUOTE = re.compile(r"""=\s*["']""")
+
+# How long an unclosed comment or quoted value is waited for before falling back
+# to the reference behaviour. Bounds how much a stalled feed() has to scan again.
+MAX_PENDING = 64 * 1024
+
 class HTMLParser:
 
     SELF_CLOSING_TAGS = [
@@ -13,26 +32,57 @@ class HTMLParser:
         "meta", "title", "style", "script",
     ]
 
-    def __init__(self, body, is_view_source):
+    # Elements whose content is raw text up to their end tag
+    RAW_TEXT_END = {
+        "script": re.compile(r"</script[\s/>]", re.IGNORECASE),
+        "style": re.compile(r"</style[\s/>]", re.IGNORECASE),
+    }
+    # Raw text kept back at the end of a chunk, an end tag cut in half is never longer
+    RAW_TEXT_KEEP = len("</script")
+
+    # tokenizer="reference" selects the original character-by-character loop,
+    # which is kept around to check the fast tokenizer against.
+    def __init__(self, body="", is_view_source=False, tokenizer="fast"):
         self.body = body
         self.unfinished = []
         self.is_view_source = is_view_source
+        self.tokenizer = tokenizer
+
+        # Tokenizer state that has to survive between two calls to feed()
+        self.buffer = ""
+        self.in_tag = False
+        self.text_parts = []
+        self.raw_tag = None
+        self.source = []
+
+        # Insertion mode, kept up to date as elements are pushed and popped so that
+        # implicit_tags never has to look at the stack of open elements
+        self.mode = "before html"
+
+    def update_mode(self):
+        depth = len(self.unfinished)
+        if depth == 0:
+            self.mode = "before html"
+        elif depth == 1 and self.unfinished[0].tag == "html":
+            self.mode = "before head"
+        elif depth == 2 and self.unfinished[0].tag == "html" and self.unfinished[1].tag == "head":
+            self.mode = "in head"
+        else:
+            self.mode = "in body"
 
     def implicit_tags(self, tag):
         while True:
-            open_tags = [node.tag for node in self.unfinished]
-
-            if open_tags == [] and tag != "html":
+            if self.mode == "before html" and tag != "html":
                 self.add_tag("html")
 
-            elif open_tags == ["html"] and tag not in ["head", "body", "/html"]:
+            elif self.mode == "before head" and tag not in ["head", "body", "/html"]:
                 if tag in self.HEAD_TAGS:
                     self.add_tag("head")
 
                 else:
                     self.add_tag("body")
 
-            elif open_tags == ["html", "head"] and tag not in ["/head"] + self.HEAD_TAGS:
+            elif self.mode == "in head" and tag != "/head" and tag not in self.HEAD_TAGS:
                 self.add_tag("/head")
 
             else:
@@ -42,18 +92,19 @@ class HTMLParser:
         if not self.unfinished:
             self.implicit_tags(None)
 
-        while len(self.unfinished) > 1:
-            node = self.unfinished.pop()
-            parent = self   .unfinished[-1]
-            parent.children.append(node)
-        return self.unfinished.pop()
+        # Nodes are attached to their parent when they are opened, so all that is
+        # left to do is to close whatever is still open.
+        root = self.unfinished[0]
+        self.unfinished = []
+        self.update_mode()
+        return root
     
     def add_text(self, text):
         if text.isspace(): return
         self.implicit_tags(None)
         parent = self.unfinished[-1]
         node = Text(text, parent)
-        parent.children.append(node)
+        parent.append_child(node)
 
     def add_tag(self, tag):
         tag, attributes = self.get_attributes(tag)
@@ -65,20 +116,22 @@ class HTMLParser:
         if tag.startswith("/"):
             if len(self.unfinished) == 1: 
                 return
-            node = self.unfinished.pop()
-            parent = self.unfinished[-1]
-            parent.children.append(node)
+            self.unfinished.pop()
+            self.update_mode()
 
         elif tag in self.SELF_CLOSING_TAGS:
             parent = self.unfinished[-1] 
             node = Element(tag, attributes, parent)
             if parent:
-                parent.children.append(node)
+                parent.append_child(node)
 
         else:
             parent = self.unfinished[-1] if self.unfinished else None
             node = Element(tag, attributes, parent)
+            if parent:
+                parent.append_child(node)
             self.unfinished.append(node)
+            self.update_mode()
     
     def get_attributes(self, text):
         parts = text.split()
@@ -97,29 +150,180 @@ class HTMLParser:
 
         return tag, attributes
 
-    def parse(self):
-        if self.is_view_source: # return the whole html body as plain text
-            return Text(self.body)
+    def feed(self, chunk):
+        # Parse the next piece of the document. The tree is built as we go, and text or
+        # a tag that is cut in half by the end of the chunk is kept until the next one.
+        if self.is_view_source:
+            self.source.append(chunk)
+        elif self.tokenizer == "reference":
+            self.feed_reference(chunk)
         else:
-            text = ""
-            in_tag = False
-
-            for c in self.body:
-                if c == "<":
-                    in_tag = True
-                    if text: self.add_text(text)
-                    text = ""
-                elif c == ">":
-                    in_tag = False
-                    self.add_tag(text)
-                    text = ""
+            self.feed_fast(chunk)
+
+    def feed_reference(self, chunk):
+        text = self.buffer
+        in_tag = self.in_tag
+
+        for c in chunk:
+            if c == "<":
+                in_tag = True
+                if text: self.add_text(text)
+                text = ""
+            elif c == ">":
+                in_tag = False
+                self.add_tag(text)
+                text = ""
+            else:
+                text += c
+
+        self.buffer = text
+        self.in_tag = in_tag
+
+    def feed_fast(self, chunk, final=False):
+        # Match whole tokens with one compiled regex and slice them out at once instead
+        # of looking at every character. self.buffer holds an unfinished tag, comment or
+        # raw text from the previous chunk, self.text_parts the text seen since the last tag.
+        # With final set no more data is coming, so nothing is left waiting.
+        data = self.buffer + chunk if self.buffer else chunk
+        self.buffer = ""
+        add_text = self.add_text
+        add_tag = self.add_tag
+        i = 0
+        n = len(data)
+
+        while i < n:
+            if self.raw_tag:
+                end = self.RAW_TEXT_END[self.raw_tag].search(data, i)
+                if end is None:
+                    # Hand over all but the tail, so the next chunk is not searched
+                    # from the start of the element again
+                    keep = max(i, n - self.RAW_TEXT_KEEP)
+                    if keep > i:
+                        self.text_parts.append(data[i:keep])
+                    i = keep
+                    break
+                if self.text_parts:
+                    self.text_parts.append(data[i:end.start()])
+                    self.flush_text()
+                elif end.start() > i:
+                    add_text(data[i:end.start()])
+                self.raw_tag = None
+                i = end.start() # the end tag itself is handled as a normal tag
+
+            start = i
+            for token in TOKEN.finditer(data, i):
+                if token.start() != i:
+                    break # a tag or comment that is not complete yet
+                kind = token.lastindex
+
+                if kind == 1:
+                    if token.end() == n and not final:
+                        break # the text may go on in the next chunk
+                    if self.text_parts:
+                        self.text_parts.append(token.group(1))
+                        self.flush_text()
+                    else:
+                        add_text(token.group(1))
+
+                elif kind == 2:
+                    if self.text_parts: self.flush_text()
+
                 else:
-                    text += c
-            if not in_tag and text:
-                self.add_text(text)
+                    tag = token.group(kind)
+                    if tag.startswith("!--") or kind > 3 and OPEN_QUOTE.search(tag):
+                        if not final and n - i < MAX_PENDING:
+                            break # the "-->" or closing quote may still arrive
+                    if self.text_parts: self.flush_text()
+                    if kind == 5:
+                        if tag: add_text(tag)
+                        i = token.end()
+                        continue
+                    i = token.end()
+                    if tag.strip():
+                        add_tag(tag)
+                        name = tag.split(None, 1)[0].casefold()
+                        if name in self.RAW_TEXT_END:
+                            self.raw_tag = name
+                            break
+                    continue
+
+                i = token.end()
+
+            if not self.raw_tag or i == start:
+                break
+
+        if i < n and not self.raw_tag and data[i] != "<":
+            # Trailing text, keep it apart until we know where it ends
+            self.text_parts.append(data[i:])
+            i = n
+        self.buffer = data[i:]
+
+    def flush_text(self):
+        if not self.text_parts: return
+        text = "".join(self.text_parts)
+        self.text_parts = []
+        if text: self.add_text(text)
+
+    def close(self):
+        # Signal the end of the document and return the root of the tree
+        if self.is_view_source: # return the whole html body as plain text
+            return Text("".join(self.source), None)
+
+        if self.tokenizer == "reference":
+            if not self.in_tag and self.buffer:
+                self.add_text(self.buffer)
+        else:
+            # Whatever was kept waiting is tokenized as it is. Unclosed raw text runs
+            # to the end of the document, only a "<" without any ">" is dropped.
+            if self.buffer and not self.raw_tag:
+                self.feed_fast("", final=True)
+            if self.raw_tag:
+                self.text_parts.append(self.buffer)
+            self.flush_text()
+        self.buffer = ""
         return self.finish()
+
+    def parse(self):
+        self.feed(self.body)
+        return self.close()
     
 def print_tree(node, indent=0):
-    print(" " * indent, node)
-    for child in node.children:
-        print_tree(child, indent + 2)
\ No newline at end of file
+    stack = [(node, indent)]
+    while stack:
+        node, indent = stack.pop()
+        print(" " * indent, node)
+        stack.extend((child, indent + 2) for child in reversed(node.children))
+
+def to_html(node, pretty=False):
+    # Serialize a tree back into markup. With pretty=True every tag and piece of text
+    # goes on a line of its own, indented by one space per level.
+    lines = []
+    stack = [(node, 0, False)]
+    while stack:
+        node, depth, closing = stack.pop()
+        indent = " " * depth if pretty else ""
+        if closing:
+            lines.append(indent + "</" + node.tag + ">")
+        elif isinstance(node, Text):
+            text = node.text.strip() if pretty else node.text
+            if text:
+                lines.append(indent + text)
+        else:
+            lines.append(indent + start_tag(node))
+            if node.tag not in HTMLParser.SELF_CLOSING_TAGS:
+                stack.append((node, depth, True))
+                stack.extend((child, depth + 1, False) for child in reversed(node.children))
+
+    if pretty:
+        return "\n".join(lines) + "\n"
+    return "".join(lines)
+
+def start_tag(element):
+    parts = ["<", element.tag]
+    for key, value in element.attributes.items():
+        if value:
+            parts.append(f' {key}="{value.replace(chr(34), "&quot;")}"')
+        else:
+            parts.append(" " + key)
+    parts.append(">")
+    return "".join(parts)
@@ -0,0 +1,129 @@
+import codecs
+import zlib
+
+CHUNK_SIZE = 64 * 1024
+
+# Each of the iter_* body readers yields raw bytes as they arrive and returns True
+# if the body was read to its end, so the caller knows if the connection can be reused.
+
+def iter_body(response, headers, status):
+    if status in (204, 304) or 100 <= status < 200:
+        return True
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        return (yield from iter_chunked(response))
+    elif "content-length" in headers:
+        return (yield from iter_length(response, int(headers["content-length"])))
+    else:
+        return (yield from iter_until_close(response))
+
+def iter_chunked(response):
+    while True:
+        line = response.readline()
+        size = line.strip().split(b";")[0]
+        if not size:
+            return False
+        remaining = int(size, 16)
+        if remaining == 0:
+            # Last chunk, skip any trailers up to the closing empty line so the
+            # connection is left at the start of the next response.
+            while response.readline() not in (b"\r\n", b"\n", b""):
+                pass
+            return True
+
+        while remaining > 0:
+            data = response.read1(min(remaining, CHUNK_SIZE))
+            if not data:
+                return False
+            remaining -= len(data)
+            yield data
+        response.read(2)
+
+def iter_length(response, length):
+    remaining = length
+    while remaining > 0:
+        data = response.read1(min(remaining, CHUNK_SIZE))
+        if not data:
+            return False
+        remaining -= len(data)
+        yield data
+    return True
+
+def iter_until_close(response):
+    while True:
+        data = response.read1(CHUNK_SIZE)
+        if not data:
+            return False
+        yield data
+
+def iter_decompressed(chunks, content_encoding):
+    content_encoding = content_encoding.lower()
+    if content_encoding in ["gzip", "x-gzip"]:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif content_encoding == "deflate":
+        decompressor = zlib.decompressobj()
+    else:
+        yield from chunks
+        return
+
+    started = False
+    for chunk in chunks:
+        try:
+            data = decompressor.decompress(chunk, CHUNK_SIZE)
+        except zlib.error:
+            # Some servers send raw deflate data without the zlib header
+            if content_encoding != "deflate" or started:
+                raise
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            data = decompressor.decompress(chunk, CHUNK_SIZE)
+        started = True
+
+        # Bound the output of a single chunk, a small input can inflate to a lot of data
+        while True:
+            if data:
+                yield data
+            if not decompressor.unconsumed_tail:
+                break
+            data = decompressor.decompress(decompressor.unconsumed_tail, CHUNK_SIZE)
+
+    data = decompressor.flush()
+    if data:
+        yield data
+
+def get_charset(headers):
+    content_type = headers.get("content-type", "")
+    for param in content_type.split(";")[1:]:
+        name, _, value = param.strip().partition("=")
+        if name.strip().lower() == "charset":
+            charset = value.strip().strip("\"'")
+            try:
+                return codecs.lookup(charset).name
+            except LookupError:
+                return None
+    return None
+
+def iter_decoded(chunks, charset=None):
+    # Decode a stream of bytes incrementally, a multi-byte character split between two
+    # chunks is held back until the rest of it arrives. Without a declared charset we
+    # assume UTF-8 and switch to a common legacy encoding if the data turns out not to be.
+    if charset:
+        decoder = codecs.getincrementaldecoder(charset)(errors="replace")
+    else:
+        decoder = codecs.getincrementaldecoder("utf-8")()
+
+    for chunk in chunks:
+        try:
+            text = decoder.decode(chunk)
+        except UnicodeDecodeError:
+            pending, _ = decoder.getstate()
+            decoder = codecs.getincrementaldecoder("iso-8859-1")()
+            text = decoder.decode(pending + chunk)
+        if text:
+            yield text
+
+    try:
+        text = decoder.decode(b"", final=True)
+    except UnicodeDecodeError:
+        pending, _ = decoder.getstate()
+        text = pending.decode("iso-8859-1")
+    if text:
+        yield text
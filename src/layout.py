@@ -1,10 +1,11 @@
-import tkinter.font
 from .text import Text
 from .element import Element
-from .draw import DrawRect, DrawText
+from .draw import DrawRect, DrawText, DrawImage
+from .fonts import get_font, get_word_width, get_font_metrics
+from .emoji_atlas import get_emoji_matcher, EMOJI_SIZE
 
 HSTEP, VSTEP = 13, 18
-FONTS = {}
+LINE_BREAK = None
 BLOCK_ELEMENTS = [
     "html", "body", "article", "section", "nav", "aside",
     "h1", "h2", "h3", "h4", "h5", "h6", "hgroup", "header",
@@ -27,23 +28,50 @@ class BlockLayout:
         self.width = width
         self.height = None
 
+        # layout_dirty: this block has to be laid out again.
+        # children_dirty: this block is fine but some block below it is not.
+        self.layout_dirty = True
+        self.children_dirty = True
+
         self.display_list = []
 
+        # Measured words of an inline block, kept between layouts so a resize only
+        # has to break them into lines again. LINE_BREAK marks a <br>.
+        self.words = None
+
     def recurse(self, node):
-        if isinstance(node, Text):
-            for word in node.text.split():
-                self.word(node, word)
-        else:
-            if node.tag == "br":
-                self.flush()
-            
-            for child in node.children:
-                self.recurse(child)
+        # Walks the inline content in document order with an explicit stack
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            node.layout_dirty = False
+            if isinstance(node, Text):
+                for pieces in text_segments(node):
+                    # The pieces of a word are laid out without spaces between them
+                    last = len(pieces) - 1
+                    for i, (is_emoji, piece) in enumerate(pieces):
+                        if is_emoji:
+                            self.emoji(node, piece, i == last)
+                        else:
+                            self.word(node, piece, i == last)
+            else:
+                node.children_dirty = False
+                if node.tag == "br":
+                    self.words.append(LINE_BREAK)
+                
+                stack.extend(reversed(node.children))
     
     def layout_intermediate(self):
+        # Blocks for nodes that were already laid out are kept, they decide for
+        # themselves if they need to be laid out again
+        old_children = {child.node: child for child in self.children}
+        self.children = []
         previous = None
         for child in self.node.children:
-            next = BlockLayout(child, self, previous, self.width)
+            next = old_children.get(child)
+            if next is None:
+                next = BlockLayout(child, self, previous, self.width)
+            next.previous = previous
             self.children.append(next)
             previous = next
 
@@ -58,78 +86,138 @@ class BlockLayout:
             return "block"
     
     def layout(self):
-        self.x = self.parent.x
-        self.width = self.parent.width
+        # Lays out this block and every block below it. The tree is walked with an explicit
+        # stack so deeply nested documents do not hit the recursion limit: a block is
+        # positioned before its children and gets its height once they are all done.
+        stack = [(self, False)]
+        while stack:
+            block, children_done = stack.pop()
+            if children_done:
+                block.finish_layout()
+            elif block.start_layout():
+                stack.append((block, True))
+                stack.extend((child, False) for child in reversed(block.children))
+
+    def start_layout(self):
+        # Returns False if the block and everything below it could be reused as is
+        x = self.parent.x
+        width = self.parent.width
 
         if self.previous:
-            self.y = self.previous.y + self.previous.height
+            y = self.previous.y + self.previous.height
         else:
-            self.y = self.parent.y
+            y = self.parent.y
+
+        self.mode = self.layout_mode()
+        resized = x != self.x or width != self.width
+        self.layout_dirty = self.layout_dirty or self.node.layout_dirty
+        self.children_dirty = self.node.children_dirty
+        if self.mode == "inline" and self.children_dirty:
+            # An inline block owns all the text below its node, any of it being dirty
+            # means the lines have to be broken again
+            if not self.layout_dirty and not has_dirty_descendant(self.node):
+                clear_children_dirty(self.node)
+                self.children_dirty = False
+            else:
+                self.layout_dirty = True
+
+        if not self.layout_dirty and not self.children_dirty and not resized:
+            # Nothing changed in here, the block only has to move to its new position
+            self.shift(y - self.y)
+            return False
+
+        self.x = x
+        self.y = y
+        self.width = width
+        self.node.layout_dirty = False
+        if isinstance(self.node, Element):
+            self.node.children_dirty = False
 
-        mode = self.layout_mode()
-        if mode == "block":
-            self.layout_intermediate()
+        if self.mode == "block":
+            if self.layout_dirty:
+                self.layout_intermediate()
         else:
-            self.cursor_x = 0
-            self.cursor_y = 0
-            self.weight = "normal"
-            self.style = "roman"
-            self.size = 12
-            self.layout_width_cache = {}
-            self.line = []
-            self.recurse(self.node)
-            self.flush()
-
-        for child in self.children:
-            child.layout()
-            self.display_list.extend(child.display_list)
-
-        if mode == "block":
+            self.children = []
+            if self.layout_dirty or self.words is None:
+                self.words = []
+                self.recurse(self.node)
+            # A block that was only resized keeps its measured words
+            self.break_lines()
+        return True
+
+    def finish_layout(self):
+        if self.mode == "block":
             self.height = sum([
                 child.height for child in self.children])
         else:
             self.height = self.cursor_y
-
-    def get_width(self, word, font):
-        if word not in self.layout_width_cache:
-            self.layout_width_cache[word] = font.measure(word)
-
-        return self.layout_width_cache[word]  
-
-    def word(self, node, word):
+        self.layout_dirty = False
+        self.children_dirty = False
+
+    def shift(self, dy):
+        # Move a clean block and everything below it down by dy
+        if not dy: return
+        stack = [self]
+        while stack:
+            block = stack.pop()
+            block.y += dy
+            block.display_list = [(x, y + dy, word, font, color, linespace)
+                for x, y, word, font, color, linespace in block.display_list]
+            stack.extend(block.children)
+
+    def word(self, node, word, space_after=True):
         color = node.style.get("color", "black")
         if isinstance(node, Element) and node.tag == "a":
             print(f"LINK COLOR: {color}")  # <-- diagnosti
         #color = node.style["color"]
-        weight = node.style["font-weight"]
-        style = node.style["font-style"]
-        # font-style needs to be translated from CSS "normal" to Tk "roman"
-        if style == "normal": style = "roman"
-        # font-size needs to be translated from CSS pixels to Tk points 
-        size = int(float(node.style["font-size"][:-2]) * 0.75)
-        font = get_font(size, weight, style)
-
-        width = self.get_width(word, font)
-        if self.cursor_x + width >= self.width:
-            self.flush()
-        self.line.append((self.cursor_x, word, font, color))
-        self.cursor_x += width + font.measure(" ")
+        key, font = node_font(node)
+
+        space, ascent, descent, linespace = get_font_metrics(key, font)
+        width = get_word_width(key, font, word)
+        if not space_after:
+            space = 0
+        self.words.append((word, font, color, width, space, ascent, descent, linespace))
+
+    def emoji(self, node, sequence, space_after=True):
+        # A fixed size box sitting on the baseline, it has no font to draw with
+        space = 0
+        if space_after:
+            key, font = node_font(node)
+            space = get_font_metrics(key, font)[0]
+        self.words.append((sequence, None, None, EMOJI_SIZE, space, EMOJI_SIZE, 0, EMOJI_SIZE))
+
+    def break_lines(self):
+        # Lay the measured words out into lines for the current width, nothing is
+        # measured here
+        self.display_list = []
+        self.cursor_x = 0
+        self.cursor_y = 0
+        self.line = []
+        for item in self.words:
+            if item is LINE_BREAK:
+                self.flush()
+                continue
+            word, font, color, width, space, ascent, descent, linespace = item
+            if self.cursor_x + width >= self.width:
+                self.flush()
+            self.line.append((self.cursor_x, word, font, color, ascent, descent, linespace))
+            self.cursor_x += width + space
+        self.flush()
 
     def flush(self):
         if not self.line: return
 
-        metrics = [font.metrics() for x, word, font, color in self.line]
-        max_ascent = max([metric["ascent"] for metric in metrics])
+        max_ascent = max([item[4] for item in self.line])
         baseline = self.cursor_y + 1.25 * max_ascent
 
-        for rel_x, word, font, color in self.line:
+        for rel_x, word, font, color, ascent, descent, linespace in self.line:
             x = self.x + rel_x
-            y = self.y + baseline - font.metrics("ascent")
-            self.display_list.append((x, y, word, font, color))
+            y = self.y + baseline - ascent
+            self.display_list.append((x, y, word, font, color, linespace))
 
         self.cursor_x = 0
+        max_descent = max([item[5] for item in self.line])
         self.line = []
-        max_descent = max([metric["descent"] for metric in metrics])
         self.cursor_y = baseline + 1.25 * max_descent
 
     def paint(self):
@@ -144,8 +232,11 @@ class BlockLayout:
                     rect = DrawRect(self.x, self.y, x2, y2, bgcolor)
                     cmds.append(rect)
 
-            for x, y, word, font, color in self.display_list:
-                cmds.append(DrawText(x, y, word, font, color))
+            for x, y, word, font, color, linespace in self.display_list:
+                if font is None:
+                    cmds.append(DrawImage(x, y, word, linespace))
+                else:
+                    cmds.append(DrawText(x, y, word, font, color, linespace))
 
         return cmds
 
@@ -157,12 +248,14 @@ class DocumentLayout:
         self.layout_width = width
 
     def layout(self):
+        # Can be called again after the DOM changed, only dirty blocks are laid out again
         self.width = self.layout_width - (2 * HSTEP)
         self.x = HSTEP
         self.y = VSTEP
 
-        child = BlockLayout(self.node, self, None, self.layout_width)
-        self.children.append(child)
+        if not self.children:
+            self.children.append(BlockLayout(self.node, self, None, self.layout_width))
+        child = self.children[0]
         child.layout()
 
         self.height = child.height
@@ -170,19 +263,54 @@ class DocumentLayout:
     def paint(self):
         return []
 
+def has_dirty_descendant(node):
+    # Follow children_dirty flags down to see if anything below node needs a relayout.
+    # A node can be marked children_dirty for a restyle that did not change anything.
+    stack = list(node.children)
+    while stack:
+        node = stack.pop()
+        if node.layout_dirty:
+            return True
+        if node.children_dirty:
+            stack.extend(node.children)
+    return False
+
+def clear_children_dirty(node):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node.children_dirty:
+            node.children_dirty = False
+            stack.extend(node.children)
+
+def node_font(node):
+    weight = node.style["font-weight"]
+    style = node.style["font-style"]
+    # font-style needs to be translated from CSS "normal" to Tk "roman"
+    if style == "normal": style = "roman"
+    # font-size needs to be translated from CSS pixels to Tk points 
+    size = int(float(node.style["font-size"][:-2]) * 0.75)
+    return (size, weight, style), get_font(size, weight, style)
+
+def text_segments(node):
+    # The words of a text node, each split into text runs and emoji. The text is only
+    # searched for emoji once, and the result is kept on the node for later layouts.
+    if node.segments is None or node.segments[0] is not node.text:
+        # Plain ASCII text cannot have emoji, the matcher is not even loaded for it
+        matcher = None if node.text.isascii() else get_emoji_matcher()
+        if matcher and matcher.has_emoji(node.text):
+            words = [matcher.split(word) for word in node.text.split()]
+        else:
+            words = [[(False, word)] for word in node.text.split()]
+        node.segments = (node.text, words)
+    return node.segments[1]
+
 def paint_tree(layout_object, display_list):
-    display_list.extend(layout_object.paint())
-
-    for child in layout_object.children:
-        paint_tree(child, display_list)
-
-def get_font(size, weight, style):
-    key = (size, weight, style)
-    if key not in FONTS:
-        font = tkinter.font.Font(size=size, weight=weight, slant=style)
-        label = tkinter.Label(font=font)
-        FONTS[key] = (font, label)
-    return FONTS[key][0]
+    stack = [layout_object]
+    while stack:
+        layout_object = stack.pop()
+        display_list.extend(layout_object.paint())
+        stack.extend(reversed(layout_object.children))
 
     """
     def open_tag(self, tag):
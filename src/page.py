@@ -0,0 +1,58 @@
+import os
+from .html_parser import HTMLParser
+from .css_parser import CSSParser, iter_tree
+from .element import Element
+from .url import request_all
+from . import startup
+
+# Loading a page up to a styled DOM, shared by the Tk browser and the headless renderer
+
+BROWSER_CSS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "browser.css")
+DEFAULT_STYLE_SHEET = None
+
+def default_style_sheet():
+    # browser.css is found next to the sources, not in the working directory, and only
+    # parsed once per process. Copy the list before adding rules to it.
+    global DEFAULT_STYLE_SHEET
+    if DEFAULT_STYLE_SHEET is None:
+        with open(BROWSER_CSS) as f:
+            DEFAULT_STYLE_SHEET = CSSParser(f.read()).parse()
+    return DEFAULT_STYLE_SHEET
+
+def load_dom(url):
+    # Build the DOM while the body is still arriving
+    parser = HTMLParser("", url.is_view_source)
+    try:
+        for chunk in url.stream():
+            parser.feed(chunk)
+    except Exception as e:
+        print(f"Error loading page: {e}")
+    nodes = parser.close()
+    startup.mark("fetch + parse")
+    return nodes
+
+def load_stylesheets(nodes, url):
+    # Rules of every <link rel=stylesheet> in the page, in document order
+    links = [node.attributes["href"]
+        for node in iter_tree(nodes)
+        if isinstance(node, Element)
+        and node.tag == "link"
+        and node.attributes.get("rel") == "stylesheet"
+        and "href" in node.attributes]
+
+    # Resolve every link and fetch the stylesheets in parallel, then append
+    # their rules in document order so the cascade is the same as a sequential load
+    style_urls = []
+    for link in links:
+        try:
+            style_urls.append(url.resolve(link))
+        except:
+            continue
+
+    rules = []
+    for body in request_all(style_urls):
+        if body is None:
+            continue
+        rules.extend(CSSParser(body).parse())
+    startup.mark("stylesheets")
+    return rules
@@ -0,0 +1,45 @@
+import sys
+import time
+
+# Startup timing for `main.py --startup-report`. This module is imported first, so
+# its import time stands in for the start of the process. Every phase reports its
+# own and total time and the top-level modules that were imported during it.
+
+START = time.perf_counter()
+MODULES = set(sys.modules)
+REPORT = None
+
+class StartupReport:
+    def __init__(self, start, modules):
+        self.last = start
+        self.start = start
+        self.modules = set(modules)
+        self.phases = []
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        new = sorted({name.split(".")[0] for name in sys.modules
+            if name not in self.modules and not name.startswith("_")})
+        self.modules = set(sys.modules)
+        self.phases.append((phase, now - self.last, now - self.start, new))
+        self.last = now
+
+    def print(self):
+        print(f"{'phase':<16} {'self ms':>8} {'total ms':>9}  imported")
+        for phase, own, total, modules in self.phases:
+            print(f"{phase:<16} {own * 1000:>8.1f} {total * 1000:>9.1f}  {' '.join(modules)}")
+
+def enable():
+    global REPORT
+    REPORT = StartupReport(START, MODULES)
+
+def mark(phase):
+    if REPORT is not None:
+        REPORT.mark(phase)
+
+def finish():
+    # Print the report, later calls to mark do nothing
+    global REPORT
+    if REPORT is not None:
+        REPORT.print()
+        REPORT = None
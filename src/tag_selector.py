@@ -1,22 +1,64 @@
 from .element import Element
 
+FILTER_BITS = 12
+FILTER_MASK = (1 << FILTER_BITS) - 1
+
+def tag_hashes(tag):
+    # The two slots a tag occupies in an AncestorFilter
+    h = hash(tag)
+    return h & FILTER_MASK, (h >> FILTER_BITS) & FILTER_MASK
+
+class AncestorFilter:
+    # Counting bloom filter over the tags of the elements above the node being styled.
+    # It can answer "maybe" for a tag that is not there, but never "no" for one that
+    # is, so a miss is enough to reject a descendant selector without walking the tree.
+    def __init__(self):
+        self.counts = [0] * (FILTER_MASK + 1)
+
+    def push(self, tag):
+        a, b = tag_hashes(tag)
+        self.counts[a] += 1
+        self.counts[b] += 1
+
+    def pop(self, tag):
+        a, b = tag_hashes(tag)
+        self.counts[a] -= 1
+        self.counts[b] -= 1
+
+    def might_contain(self, hashes):
+        counts = self.counts
+        for a, b in hashes:
+            if not counts[a] or not counts[b]:
+                return False
+        return True
+
 class TagSelector:
     def __init__(self, tag):
-        self.tag = tag
+        # Lowercased once here, tag names in the DOM are already casefolded by the HTML parser
+        self.tag = tag.casefold()
+        self.key = self.tag # tag a node must have for this selector to match
+        self.tags = [self.tag] # every tag the selector needs on the node or its ancestors
         self.priority = 1
         
-    def matches(self, node):
-        return isinstance(node, Element) and self.tag.lower() == node.tag.lower()
+    def matches(self, node, ancestors=None):
+        return isinstance(node, Element) and self.tag == node.tag
 
 class DescendantSelector:
     def __init__(self, ancestor, descendant):
         self.ancestor = ancestor
         self.descendant = descendant
+        self.key = descendant.key
+        self.tags = ancestor.tags + descendant.tags
+        self.ancestor_hashes = [tag_hashes(tag) for tag in set(ancestor.tags)]
         self.priority = self.ancestor.priority + self.descendant.priority
 
-    def matches(self, node):
+    def matches(self, node, ancestors=None):
         if not self.descendant.matches(node): return False
 
+        # Every tag on the ancestor side has to be somewhere above the node
+        if ancestors is not None and not ancestors.might_contain(self.ancestor_hashes):
+            return False
+
         while node.parent:
             if self.ancestor.matches(node.parent): return True
             node = node.parent
@@ -25,4 +67,3 @@ class DescendantSelector:
 def cascade_priority(rule):
     selector, body = rule
     return selector.priority
-        
@@ -1,8 +1,19 @@
 class Text:
+    __slots__ = ("text", "parent", "style", "style_dirty", "layout_dirty", "segments")
+
+    # Text nodes never have children
+    children = ()
+    children_dirty = False
+
     def __init__(self, text, parent):
         self.text = text
-        self.children = []
         self.parent = parent
+
+        # A new node has never been styled or laid out
+        self.style_dirty = True
+        self.layout_dirty = True
+        # (text, words split into text runs and emoji), filled in by the layout
+        self.segments = None
     
     def __repr__(self):
-        return repr(self.text)
\ No newline at end of file
+        return repr(self.text)
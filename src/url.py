@@ -1,12 +1,19 @@
-import socket
-import ssl
+import binascii
 import time
-import gzip
-from bs4 import BeautifulSoup 
+import threading
+from urllib.parse import unquote
+from .connection_pool import ConnectionPool
+from .disk_cache import DiskCache, has_validators
+from .html_parser import HTMLParser, to_html
+from .file_stream import iter_file
+from .http_stream import iter_body, iter_decompressed, iter_decoded, get_charset
+
+MAX_CONNECTIONS_PER_HOST = 6
+MAX_FETCH_WORKERS = 16
 
 class URL:
-    open_sockets = {}
-    response_cache = {}
+    connection_pool = ConnectionPool()
+    response_cache = DiskCache()
 
     def __init__(self, url):
         self.is_view_source = False
@@ -15,6 +22,7 @@ class URL:
         if url.startswith("view-source"):
             self.is_view_source = True
             url = url[len("view-source:"):] # Remove view-source prefix
+        has_authority = "://" in url
         try:
             if "://" not in url: 
                 self.scheme, url = url.split(":", 1)
@@ -26,10 +34,16 @@ class URL:
         assert self.scheme in ["http", "https", "file", "data", "about"]
 
         if self.scheme == "file":
-            # For file URLs - no host, no port, just file path
+            # For file URLs - no host, no port, just file path. What is left here is
+            # "/path" for file:///path and file:/path, "host/path" for
+            # file://localhost/path, whose host is ignored, or a relative path for
+            # file:path, which is kept as it is.
             self.host = None    
             self.port = None
-            self.path = url 
+            if has_authority and not url.startswith("/"):
+                _, _, url = url.partition("/")
+                url = "/" + url
+            self.path = unquote(url)
 
         elif self.scheme == "data":
             # For data html/text URLs
@@ -52,6 +66,17 @@ class URL:
                 self.host, port = self.host.split(":", 1)
                 self.port = int(port)
     
+    def __str__(self):
+        if self.scheme in ["http", "https"]:
+            default_port = 80 if self.scheme == "http" else 443
+            port = "" if self.port == default_port else ":" + str(self.port)
+            return self.scheme + "://" + self.host + port + self.path
+        elif self.scheme == "file":
+            return ("file://" if self.path.startswith("/") else "file:") + self.path
+        elif self.scheme == "data":
+            return "data:" + self.mediaType + "," + self.dataContent
+        return "about:blank"
+
     def set_about_blank(self):
         self.scheme = "about"
         self.path = "blank"
@@ -60,118 +85,87 @@ class URL:
         
     def request(self, redirect_limit=5):
         try:
-            if redirect_limit <= 0:
-                return "Error: Too many redirects"
-            
-            if self.scheme == "file":
-                return self.handle_file_request()
-                
-            elif self.scheme == "data":
-                return self.handle_data_request()
-            
-            elif self.scheme == "about" and self.path == "blank":
-                return ""
-            
-            else:
-                # Handling HTTP/HTTPS requests
-                cache_key = str(self)
-                cached = URL.response_cache.get(cache_key)
-
-                if cached:
-                    if time.time() < cached["expires"]:
-                        print("Returning cached content")
-                        return cached["content"]
-                    else:
-                        print("Time expired, removing cached object")
-                        del URL.response_cache[cache_key]
-
-                s = self.get_socket()
-                s.settimeout(10.0)
-
-                request = self.create_http_request()
-                
-                s.send(request.encode("utf8"))
-
-                response = s.makefile("rb", newline=b"\r\n")
-                statusline = response.readline().decode("utf-8")
-                _, status, _ = statusline.split(" ", 2)
-                response_headers = {}
-
-                while True:
-                    line = response.readline()
-                    if line in (b"\r\n", b"\n", b""):
-                        break
-                    header_line = line.decode("utf-8")
-                    header, value = header_line.split(":", 1)
-                    response_headers[header.casefold()] = value.strip() 
-
-                # Handle status codes 3xx (Redirects)
-                if 300 <= int(status) < 400:
-                    redirect = response_headers.get("location")
-                    if redirect is not None:
-                        print(f"Redirecting to: {redirect}")
-                        return self.handle_redirects(redirect, redirect_limit-1)
-
-                # Handle reading of data (creating content) 
-                if response_headers.get("transfer-encoding") == "chunked":
-                    content = self.handle_transfer_encoding(response)
-                elif "content-length" in response_headers:
-                    content_length = int(response_headers.get("content-length"))
-                    content = response.read(content_length)
-                else:
-                    s.settimeout(10.0)
-                    content = response.read()
-
-                if response_headers.get("content-encoding", "").lower() == "gzip":
-                    try:
-                        content = gzip.decompress(content)
-                    except Exception as e:
-                        return f"Error decompressing gzip content: {e}"
-
-                if isinstance(content, bytes):
-                    try:
-                        content = content.decode("utf-8")
-                    except UnicodeDecodeError:
-                        try:
-                            content = content.decode("iso-8859-1")  # Fallback to common legacy encoding
-                        except Exception:
-                            content = content.decode("utf-8", errors="replace")  # Last resort: replace bad characters
-
-                # Handle caching for 200 OK responses
-                cache_key = str(self)
-                if int(status) == 200:
-                    max_age = self.should_cache(response_headers)
-                    if max_age:
-                        URL.response_cache[cache_key] = {
-                            "headers": response_headers,
-                            "content": content,
-                            "expires": time.time() + max_age,
-                        }
-
-                # Close socket if specified by header 
-                if response_headers.get("connection") == "close":
-                    key = (self.host, self.port)
-                    if key in URL.open_sockets:
-                        del URL.open_sockets[key]
-                    s.close()
-
-                return content
+            return "".join(self.stream(redirect_limit))
         except:
             self.set_about_blank()
             return ""
 
+    def stream(self, redirect_limit=5):
+        # Yields the decoded body as text chunks while it is being downloaded
+        if redirect_limit <= 0:
+            yield "Error: Too many redirects"
+        
+        elif self.scheme == "file":
+            yield from self.handle_file_request()
+            
+        elif self.scheme == "data":
+            yield self.handle_data_request()
+        
+        elif self.scheme == "about" and self.path == "blank":
+            return
+        
+        else:
+            # Handling HTTP/HTTPS requests
+            cache_key = str(self)
+            cached = URL.response_cache.get(cache_key)
+
+            # Expired entries without validators are dropped by the cache itself
+            if cached and time.time() < cached["expires"]:
+                print("Returning cached content")
+                yield cached["content"]
+                return
+
+            # A stale entry is revalidated with a conditional request instead of downloaded again
+            validators = self.get_validators(cached["headers"]) if cached else {}
+            status, response_headers, body = self.fetch(validators)
+
+            if status == 304 and cached:
+                print("Not modified, refreshing cached object")
+                for _ in body: pass # no body, but this hands the connection back to the pool
+                headers = dict(cached["headers"])
+                for header, value in response_headers.items():
+                    if header not in ["content-length", "transfer-encoding", "content-encoding"]:
+                        headers[header] = value
+                max_age = self.should_cache(headers) or 0
+                URL.response_cache.refresh(cache_key, headers, time.time() + max_age)
+                yield cached["content"]
+                return
+
+            # Handle status codes 3xx (Redirects)
+            if 300 <= status < 400:
+                redirect = response_headers.get("location")
+                if redirect is not None:
+                    for _ in body: pass # read the body so the connection can be reused
+                    print(f"Redirecting to: {redirect}")
+                    yield from self.handle_redirects(redirect, redirect_limit-1)
+                    return
+
+            # Decompress and decode the body chunk by chunk as it arrives
+            content_encoding = response_headers.get("content-encoding", "")
+            chunks = iter_decompressed(body, content_encoding)
+            chunks = iter_decoded(chunks, get_charset(response_headers))
+
+            # Handle caching for 200 OK responses, only these need the whole body kept around
+            max_age = self.should_cache(response_headers) if status == 200 else None
+            if max_age is not None and (max_age > 0 or has_validators(response_headers)):
+                content = []
+                for text in chunks:
+                    content.append(text)
+                    yield text
+                URL.response_cache.put(cache_key, response_headers, "".join(content), time.time() + max_age)
+            else:
+                yield from chunks
+
     def should_cache(self, headers):
-        cache_control = headers.get("cache-control")
+        # Returns how many seconds a response stays fresh, or None if it must not be stored.
+        # A lifetime of 0 means "store, but revalidate before every use" (no-cache).
+        cache_control = headers.get("cache-control", "").lower()
 
-        if not cache_control:
-            return False
-        
-        cache_control = headers.get("cache-control").lower()
         if "no-store" in cache_control:
-            return False
+            return None
         
         if "no-cache" in cache_control:
-            return False
+            return 0
         
         if "max-age" in cache_control:
             parts = cache_control.split(",")
@@ -182,29 +176,22 @@ class URL:
                         age = int(value)
                         return age
                     except:
-                        return False
-        return False
+                        return None
+
+        # No explicit lifetime, but the response can still be revalidated later
+        if has_validators(headers):
+            return 0
+        return None
+
+    def get_validators(self, headers):
+        validators = {}
+        if "etag" in headers:
+            validators["If-None-Match"] = headers["etag"]
+        if "last-modified" in headers:
+            validators["If-Modified-Since"] = headers["last-modified"]
+        return validators
     
-    def handle_transfer_encoding(self, response):
-        body = b""
-        while True:
-            line = response.readline()
-            if not line:
-                break
-            chunk_size_str = line.strip().decode("utf-8")
-            if not chunk_size_str:
-                break
-            chunk_size = int(chunk_size_str, 16)
-            body += response.read(chunk_size)
-            response.read(2)
-        return body
-        
     def handle_redirects(self, redirect, redirect_limit):
-        key = (self.host, self.port)
-        if key in URL.open_sockets:
-            URL.open_sockets[key].close()
-            del URL.open_sockets[key]
-
         if redirect.startswith("/"):
             redirect_url = f"{self.scheme}://{self.host}{redirect}"
         elif "://" not in redirect:
@@ -212,58 +199,119 @@ class URL:
         else:
             redirect_url = redirect 
         print(f"Following redirect to: {redirect_url}")
-        return URL(redirect_url).request(redirect_limit)
+        return URL(redirect_url).stream(redirect_limit)
     
     def handle_file_request(self):
-        # Handle file requests, just read the local file
+        # Handle file requests, the file is read and decoded a chunk at a time
         try:
-            with open(self.path, 'r') as f:
-                return f.read()
+            yield from iter_file(self.path)
         except FileNotFoundError:
-            return f"Error: File not found: {self.path}"
+            yield f"Error: File not found: {self.path}"
         except Exception as e:
-            return f"Error reading file: {e}"
+            yield f"Error reading file: {e}"
     
     def handle_data_request(self):
-        # Handle data URLs - display content to user
-        if self.mediaType == "text/html":
-            soup = BeautifulSoup(self.dataContent, "html.parser")
-            return soup.prettify()
-        elif self.mediaType == "text/plain":
-            return self.dataContent
+        # Handle data URLs - data:[<media type>][;charset=...][;base64],<data>
+        params = [param.strip() for param in self.mediaType.split(";")]
+        media_type = params[0].lower() or "text/plain"
+        is_base64 = len(params) > 1 and params[-1].lower() == "base64"
+        charset = "utf-8"
+        for param in params[1:]:
+            name, _, value = param.partition("=")
+            if name.lower() == "charset" and value:
+                charset = value
+
+        content = self.dataContent
+        if is_base64:
+            # a2b_base64 takes the str as is, the bytes it returns are decoded once
+            try:
+                content = str(binascii.a2b_base64(content), charset, "replace")
+            except (ValueError, LookupError) as e: # binascii.Error is a ValueError
+                return f"Error decoding data URL: {e}"
+
+        if media_type == "text/html":
+            if self.is_view_source:
+                # Show the source tidied up, our own parser is the only one that sees it
+                return to_html(HTMLParser(content).parse(), pretty=True)
+            return content
+        elif media_type == "text/plain":
+            return content
         else:
-            return f"Unsupported media type: {self.mediaType}"
+            return f"Unsupported media type: {media_type}"
     
-    def get_socket(self):
-        # Handle HTTP/HTTPS URLs - use socket connection
-        key = (self.host, self.port)
+    def get_socket(self, fresh=False):
+        # Handle HTTP/HTTPS URLs - borrow a keep-alive connection from the pool
+        return URL.connection_pool.acquire(self.scheme, self.host, self.port, fresh)
 
-        if key in URL.open_sockets:
-            s = URL.open_sockets[key]
-        else:
-            s = socket.socket(
-                family=socket.AF_INET, 
-                type=socket.SOCK_STREAM, 
-                proto=socket.IPPROTO_TCP,
-            )
-            
-            s.connect((self.host, self.port))
+    def fetch(self, extra_headers={}):
+        # A reused socket may have been closed by the server while it sat idle in the pool,
+        # in that case retry once on a fresh connection.
+        s, reused = self.get_socket()
+        try:
+            return self.send_request(s, extra_headers)
+        except Exception as e:
+            URL.connection_pool.discard(s)
+            if not reused or not isinstance(e, ConnectionError):
+                raise
+
+        s, _ = self.get_socket(fresh=True)
+        try:
+            return self.send_request(s, extra_headers)
+        except Exception:
+            URL.connection_pool.discard(s)
+            raise
+
+    def send_request(self, s, extra_headers={}):
+        s.settimeout(10.0)
+        request = self.create_http_request(extra_headers)
+        s.sendall(request.encode("utf8"))
 
-            if self.scheme == "https":
-                ctx = ssl.create_default_context()
-                s = ctx.wrap_socket(s, server_hostname=self.host)
-            URL.open_sockets[key] = s
+        response = s.makefile("rb", newline=b"\r\n")
+        statusline = response.readline().decode("utf-8")
+        if not statusline:
+            raise ConnectionResetError("Connection closed before a response was received")
+        version, status = statusline.split(" ", 2)[:2]
+        status = int(status)
+        response_headers = {}
 
-        return s
+        while True:
+            line = response.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            header_line = line.decode("utf-8")
+            header, value = header_line.split(":", 1)
+            response_headers[header.casefold()] = value.strip() 
+
+        # The body is read lazily, the connection goes back to the pool once it has been
+        # read to its end (even for redirects) and is closed if the reader gives up early.
+        keep_alive = version == "HTTP/1.1" and response_headers.get("connection", "").lower() != "close"
+
+        def body():
+            try:
+                complete = yield from iter_body(response, response_headers, status)
+            except BaseException:
+                response.close()
+                URL.connection_pool.discard(s)
+                raise
+            response.close()
+
+            if complete and keep_alive:
+                URL.connection_pool.release(self.scheme, self.host, self.port, s)
+            else:
+                URL.connection_pool.discard(s)
 
-    def create_http_request(self):
-        request = f"GET {self.path} HTTP/1.0\r\n"
+        return status, response_headers, body()
+
+    def create_http_request(self, extra_headers={}):
+        request = f"GET {self.path} HTTP/1.1\r\n"
 
         headers = {
             "Host": self.host,
+            "Connection": "keep-alive",
             "User-Agent": "MyBrowser",
             "Accept-Encoding": "gzip",
         }
+        headers.update(extra_headers)
 
         for key,value in headers.items():
             request += f"{key}: {value}\r\n"
@@ -275,7 +323,10 @@ class URL:
         if "://" in url: return URL(url)
 
         if not url.startswith("/"):
-            dir, _ = self.path.rsplit("/", 1)
+            if "/" in self.path:
+                dir, _ = self.path.rsplit("/", 1)
+            else:
+                dir = "." # a relative file:path in the working directory
             while url.startswith("../"):
                 _, url = url.split("/", 1)
                 if "/" in dir:
@@ -285,5 +336,30 @@ class URL:
 
         if url.startswith("//"):
             return URL(self.scheme + ":" + url)
+        elif self.scheme == "file":
+            return URL("file://" + url) if url.startswith("/") else URL("file:" + url)
         else:
             return URL(self.scheme + "://" + self.host + ":" + str(self.port) + url)
+
+
+def request_all(urls, max_per_host=MAX_CONNECTIONS_PER_HOST):
+    # Fetch several URLs concurrently and return their bodies in the same order as urls,
+    # None for the ones that failed. At most max_per_host requests go to one host at a time.
+    if not urls:
+        return []
+    # Imported here, most pages have no stylesheets to fetch and it is slow to import
+    from concurrent.futures import ThreadPoolExecutor
+
+    host_limits = {}
+    for url in urls:
+        host_limits.setdefault((url.scheme, url.host, url.port), threading.Semaphore(max_per_host))
+
+    def fetch(url):
+        with host_limits[(url.scheme, url.host, url.port)]:
+            try:
+                return url.request()
+            except Exception:
+                return None
+
+    with ThreadPoolExecutor(max_workers=min(len(urls), MAX_FETCH_WORKERS)) as executor:
+        return list(executor.map(fetch, urls))
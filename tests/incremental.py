@@ -0,0 +1,84 @@
+import random
+from src.html_parser import HTMLParser
+from src.css_parser import CSSParser, RuleIndex, style, restyle, mark_tree_dirty, iter_tree
+from src.element import Element
+from src.text import Text
+from src.layout import DocumentLayout, paint_tree
+from src.fonts import set_font_backend, HeadlessFonts
+from src.tag_selector import cascade_priority
+from src.page import default_style_sheet
+
+# restyle() and layout() only redo the dirty parts of the tree. Every change is made
+# to two copies of the page. The display list of the first one, kept up to date
+# incrementally, has to be the same as one from a fresh style and layout of the
+# second. Run with: python3 -m tests.incremental
+
+def random_page(rng, paragraphs):
+    blocks = []
+    for i in range(paragraphs):
+        words = "word " * rng.randint(1, 30)
+        blocks.append(f"<div><p>para {i} {words}<b>bold {i}</b> <i>end</i></p>"
+            f"<ul><li>x{i}</li><li>y {words}</li></ul></div>")
+    return "<html><body>" + "".join(blocks) + "</body></html>"
+
+def display_list(document):
+    cmds = []
+    paint_tree(document, cmds)
+    return cmds
+
+def fresh_display_list(nodes, rules, width):
+    # Style and lay out the whole DOM from scratch
+    style(nodes, RuleIndex(sorted(rules, key=cascade_priority)))
+    document = DocumentLayout(nodes, width)
+    document.layout()
+    return document, display_list(document)
+
+if __name__ == "__main__":
+    set_font_backend(HeadlessFonts(fixed=True))
+    failures = 0
+    checks = 0
+    for seed in range(5):
+        rng = random.Random(seed)
+        rules = list(default_style_sheet())
+        page = random_page(rng, 40)
+        nodes = HTMLParser(page).parse()
+        copy = HTMLParser(page).parse()
+        style(nodes, RuleIndex(sorted(rules, key=cascade_priority)))
+        width = 800
+        document = DocumentLayout(nodes, width)
+        document.layout()
+        elements = [[node for node in iter_tree(tree) if isinstance(node, Element)
+            and node.tag in ["p", "li", "b", "i", "ul"]] for tree in [nodes, copy]]
+
+        changes = ["append_child", "set_attribute", "stylesheet", "width"] * 3
+        rng.shuffle(changes)
+        for change in changes:
+            i = rng.randrange(len(elements[0]))
+            if change == "append_child":
+                text = "inserted " * rng.randint(1, 40)
+                for tree in elements:
+                    tree[i].append_child(Text(text, tree[i]))
+            elif change == "set_attribute":
+                value = f"font-size: {rng.choice(['200%', '50%', '20px'])}; color: c{rng.randint(0, 9)}"
+                for tree in elements:
+                    tree[i].set_attribute("style", value)
+            elif change == "stylesheet":
+                tag = rng.choice(["li", "b", "p", "ul li", "div i"])
+                rules.extend(CSSParser(f"{tag} {{ font-size: {rng.randint(8, 40)}px; }}").parse())
+                mark_tree_dirty(nodes)
+            else:
+                width = rng.choice([300, 555, 800, 1200])
+                document.layout_width = width
+
+            # What the browser does on every change
+            rule_index = RuleIndex(sorted(rules, key=cascade_priority))
+            restyle(nodes, rule_index)
+            document.layout()
+            result = display_list(document)
+
+            fresh, expected = fresh_display_list(copy, rules, width)
+            checks += 1
+            if result != expected or document.height != fresh.height:
+                failures += 1
+                print(f"Display list differs after {change} (seed {seed})")
+    print(f"{checks} changes, {failures} mismatches")
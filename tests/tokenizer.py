@@ -0,0 +1,32 @@
+from src.html_parser import HTMLParser, to_html
+
+# Malformed markup the fast tokenizer has to read the same way as the reference one,
+# fed whole and in small chunks. Run with: python3 -m tests.tokenizer
+DOCUMENTS = [
+    '<img alt="foo><p>one</p><p>two</p>',
+    "<a title=it's>link</a><p>after</p>",
+    "<p>x < y isn't</p><p>z</p>",
+    "<p>a</p><b c='d>e</b> tail",
+    "<!-- never closed > <p>x</p>",
+    "<p>cut off <",
+]
+
+def parse(document, tokenizer, chunk_size=None):
+    parser = HTMLParser(tokenizer=tokenizer)
+    chunk_size = chunk_size or len(document)
+    for i in range(0, len(document), chunk_size):
+        parser.feed(document[i:i + chunk_size])
+    return to_html(parser.close())
+
+if __name__ == "__main__":
+    failures = 0
+    for document in DOCUMENTS:
+        expected = parse(document, "reference")
+        for chunk_size in [None, 1, 3, 7]:
+            result = parse(document, "fast", chunk_size)
+            if result != expected:
+                failures += 1
+                print(f"Mismatch for {document!r} in chunks of {chunk_size}:")
+                print(f"  reference: {expected}")
+                print(f"  fast:      {result}")
+    print(f"{len(DOCUMENTS)} documents, {failures} mismatches")